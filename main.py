@@ -1,41 +1,117 @@
 import logging
+import logging.handlers
+import atexit
+import io
+import queue
 import sys
 import os
+import traceback
 from src.workflows.grading_process import grading_workflow
+from src.services.sheets_service import sheets_service
 
-# Configuración de logs optimizada para depuración inmediata
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-    datefmt='%H:%M:%S',
-    handlers=[
-        logging.StreamHandler(sys.stdout) # Asegura que salga a la terminal
-    ]
-)
+def setup_logging():
+    """
+    Configura los logs vía cola: el hilo que loggea solo encola el registro y un
+    QueueListener en segundo plano lo escribe a la terminal a través de un MemoryHandler.
+    """
+    formatter = logging.Formatter(
+        '%(asctime)s [%(levelname)s] %(threadName)s %(name)s: %(message)s',
+        datefmt='%H:%M:%S'
+    )
+    # Los logs pasan por el buffer de bloque (8 KB) de stdout; con DEBUG_TTY=1 se escriben al momento
+    debug_tty = os.getenv("DEBUG_TTY") == "1"
+    if hasattr(sys.stdout, 'buffer'):
+        log_stream = io.TextIOWrapper(
+            sys.stdout.buffer,
+            encoding=sys.stdout.encoding,
+            errors='replace',
+            line_buffering=debug_tty,
+            write_through=False
+        )
+    else:
+        log_stream = sys.stdout
+    stream_handler = logging.StreamHandler(log_stream) # Asegura que salga a la terminal
+    stream_handler.setFormatter(formatter)
+
+    if debug_tty:
+        # Depuración: cada registro llega a la terminal en cuanto se procesa
+        memory_handler = None
+        target = stream_handler
+    else:
+        # Batch: agrupa hasta 256 registros; los errores se vacían de inmediato
+        memory_handler = logging.handlers.MemoryHandler(
+            capacity=256,
+            flushLevel=logging.ERROR,
+            target=stream_handler
+        )
+        target = memory_handler
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, target)
+    listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    def flush_logs():
+        """
+        Escribe todo lo loggeado hasta ahora. Se llama antes de los print() para que no se
+        adelanten a los logs (stdout y el stream de logs tienen buffers distintos).
+        """
+        # stop() procesa lo que quede en la cola; luego se reanuda el listener
+        listener.stop()
+        if memory_handler is not None:
+            memory_handler.flush()
+        log_stream.flush()
+        listener.start()
+
+    def _shutdown():
+        # Detener el listener procesa lo que quede en la cola; luego vaciamos el buffer
+        listener.stop()
+        if memory_handler is not None:
+            memory_handler.flush()
+        log_stream.flush()
+        if log_stream is not sys.stdout:
+            # Soltamos el wrapper sin cerrar el buffer real de stdout
+            log_stream.detach()
+
+    atexit.register(_shutdown)
+    # Registrado después del cierre de logs para que corra antes (atexit es LIFO): así los
+    # avisos y errores del último envío a Sheets todavía llegan a la terminal
+    atexit.register(sheets_service.flush)
+    return flush_logs
+
+flush_logs = setup_logging()
 
 logger = logging.getLogger("main")
 
 def main():
     print("\n" + "="*50)
     print("SISTEMA DE GRADING - MODO DE DEPURACIÓN ACTIVO")
-    print("="*50 + "\n")
+    # El banner sale antes que los primeros logs del flujo
+    print("="*50 + "\n", flush=True)
 
     try:
         # Ejecutamos el flujo principal
         grading_workflow.run()
         
     except KeyboardInterrupt:
+        flush_logs()
         print("\n[!] Proceso detenido manualmente por el usuario (Ctrl+C).")
     except Exception as e:
+        flush_logs()
         print(f"\n[!!!] ERROR FATAL NO CONTROLADO EN MAIN: {e}")
-        import traceback
         traceback.print_exc()
     finally:
+        flush_logs()
         print("\n" + "="*50)
         print("PROCESO TERMINADO")
-        print("="*50)
+        print("="*50, flush=True)
 
 if __name__ == "__main__":
-    # Forzar que los prints se vean al momento en la consola de Windows/VSCode
-    sys.stdout.reconfigure(line_buffering=True) if hasattr(sys.stdout, 'reconfigure') else None
+    # Forzar que los prints se vean al momento en la consola de Windows/VSCode (solo en depuración;
+    # en corridas batch dejamos que Python use buffer de bloque)
+    if os.getenv("DEBUG_TTY") == "1" and hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=True)
     main()
\ No newline at end of file
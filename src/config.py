@@ -1,16 +1,70 @@
 import os
+import functools
 from pathlib import Path
+from types import MappingProxyType
 from dotenv import load_dotenv
 
+# Variables de entorno que usa la app y su valor por defecto
+_ENV_DEFAULTS = {
+    "PROJECT_ID": None,
+    "LOCATION": "us-west1",
+    "GEMINI_API_KEY": None,
+    "USE_VERTEX_AI": "false",
+    "SPREADSHEET_ID": None,
+    "SHEET_NAME": None,
+    "DRIVE_OUTPUT_FOLDER_ID": None,
+    "APP_VERSION": "v1.4",
+    "ENABLE_EXPLICIT_CACHE": "false",
+    "GCS_STAGING_BUCKET": None,
+    "USE_STREAMING": "false",
+}
+
+# Raíz del proyecto, resuelta una sola vez al importar
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Perfiles de timeouts/reintentos por versión de la app (seleccionado con APP_VERSION en el .env)
+DEFAULT_PROFILE = "v1.4"
+PROFILES = {
+    "v1.4": {
+        "API_TIMEOUT_SECONDS": 300,
+        "MAX_RETRIES": 2,
+        "RETRY_MIN_WAIT": 5,
+        "RETRY_MAX_WAIT": 60, # Aumentado también el tiempo máximo de espera entre reintentos
+    },
+}
+
+# Evita repetir la validación si el módulo se importa por otra ruta
+_VALIDATED = False
+
+@functools.lru_cache(maxsize=1)
+def _load_env(env_path):
+    """Parsea el .env una sola vez y devuelve un dict inmutable con las variables usadas."""
+    load_dotenv(env_path)
+    return MappingProxyType({key: os.getenv(key, default) for key, default in _ENV_DEFAULTS.items()})
+
+@functools.lru_cache(maxsize=1)
+def _ensure_fundamentos(path):
+    """Crea la carpeta de fundamentos si no existe (un solo stat por proceso)."""
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path, exist_ok=True)
+        except Exception:
+            pass
+
 class Config:
     """
     Configuración centralizada para Grading VAWA.
     Soporta conexión vía Vertex AI o Gemini API Key directa.
     """
-    APP_VERSION = "v1.4" # Versión actualizada para reflejar el aumento de timeouts y tokens
+    # Carga de variables de entorno (cacheada: el .env se lee una sola vez)
+    _ENV = _load_env(BASE_DIR / ".env")
+
+    APP_VERSION = _ENV["APP_VERSION"]
+    # Una versión sin perfil se rechaza en validate(); el perfil por defecto solo permite armar la clase
+    _PROFILE = PROFILES.get(APP_VERSION, PROFILES[DEFAULT_PROFILE])
 
     # 1. Definición de Rutas Base
-    BASE_DIR = Path(__file__).resolve().parent.parent
+    BASE_DIR = BASE_DIR
     FUNDAMENTOS_DIR = BASE_DIR / "fundamentos"
     OUTPUT_DIR = BASE_DIR / "output"
     LOCAL_OUTPUT_DIR = OUTPUT_DIR / "grading_results"  
@@ -20,22 +74,24 @@ class Config:
     OAUTH_CREDENTIALS_FILE = BASE_DIR / "client_secret_907757756276-qu2lj8eh0cp49c1oeqqumh8j1412295v.apps.googleusercontent.com.json"  
     TOKEN_FILE = BASE_DIR / "token.json"
 
-    # 2. Carga de variables de entorno
-    load_dotenv(BASE_DIR / ".env")
-
-    # 3. Configuración de IA (Vertex AI vs API Key)
-    PROJECT_ID = os.getenv("PROJECT_ID")
-    LOCATION = os.getenv("LOCATION", "us-west1") 
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    # 2. Configuración de IA (Vertex AI vs API Key)
+    PROJECT_ID = _ENV["PROJECT_ID"]
+    LOCATION = _ENV["LOCATION"]
+    GEMINI_API_KEY = _ENV["GEMINI_API_KEY"]
     # Flag para decidir el método de conexión
-    USE_VERTEX_AI = os.getenv("USE_VERTEX_AI", "false").lower() == "true"
+    USE_VERTEX_AI = _ENV["USE_VERTEX_AI"].lower() == "true"
+    # (Opcional, solo Vertex) Bucket donde se suben los PDFs del paciente para enviarlos por URI gs://
+    GCS_STAGING_BUCKET = _ENV["GCS_STAGING_BUCKET"]
     
-    # 4. Configuración de Drive y Sheets
-    SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
-    SHEET_NAME = os.getenv("SHEET_NAME")
-    DRIVE_OUTPUT_FOLDER_ID = os.getenv("DRIVE_OUTPUT_FOLDER_ID")
+    # 3. Configuración de Drive y Sheets
+    SPREADSHEET_ID = _ENV["SPREADSHEET_ID"]
+    SHEET_NAME = _ENV["SHEET_NAME"]
+    DRIVE_OUTPUT_FOLDER_ID = _ENV["DRIVE_OUTPUT_FOLDER_ID"]
+    # Las escrituras de status a Sheets se agrupan en lotes (cuota de escrituras por usuario)
+    SHEETS_FLUSH_INTERVAL_SECONDS = 0.5
+    SHEETS_FLUSH_MAX_PENDING = 20
     
-    # 5. Scopes (Permisos)
+    # 4. Scopes (Permisos)
     SERVICE_ACCOUNT_SCOPES = [
         'https://www.googleapis.com/auth/drive',
         'https://www.googleapis.com/auth/spreadsheets',
@@ -49,19 +105,51 @@ class Config:
     
     SCOPES = SERVICE_ACCOUNT_SCOPES
 
-    # 6. Configuración de Timeouts y Reintentos para IA
-    API_TIMEOUT_SECONDS = 300
-    MAX_RETRIES = 2           
-    RETRY_MIN_WAIT = 5        
-    RETRY_MAX_WAIT = 60 # Aumentado también el tiempo máximo de espera entre reintentos      
+    # 5. Configuración de Timeouts y Reintentos para IA (según el perfil de APP_VERSION)
+    API_TIMEOUT_SECONDS = _PROFILE["API_TIMEOUT_SECONDS"]
+    MAX_RETRIES = _PROFILE["MAX_RETRIES"]
+    RETRY_MIN_WAIT = _PROFILE["RETRY_MIN_WAIT"]
+    RETRY_MAX_WAIT = _PROFILE["RETRY_MAX_WAIT"]
+    # Streaming solo hace falta si algún proxy/firewall corta conexiones inactivas largas;
+    # sin él la respuesta llega completa en una sola pieza (menos CPU por caso)
+    USE_STREAMING = _ENV["USE_STREAMING"].lower() == "true"
+    # Máximo de segundos sin recibir un chunk del stream antes de darlo por colgado (se reintenta)
+    STREAM_CHUNK_TIMEOUT_SECONDS = 180
+    # Timeout por llamada a Drive (las llamadas a la IA usan API_TIMEOUT_SECONDS)
+    DRIVE_TIMEOUT_SECONDS = 60
 
-    # 7. URLs de Documentación y Prompts
+    # Hilos del pool compartido de descargas de Drive (viven todo el proceso y reutilizan su conexión)
+    DRIVE_DOWNLOAD_WORKERS = 8
+    # Archivos binarios de Drive más grandes que un bloque se descargan por rangos en paralelo
+    DRIVE_RANGE_CHUNK_BYTES = 8 * 1024 * 1024
+    DRIVE_RANGE_WORKERS = 4
+
+    # Máximo de subidas/lecturas de PDFs en paralelo
+    MAX_PARALLEL_UPLOADS = 8
+
+    # Casos (filas) que se procesan al mismo tiempo; limitar según cuotas de Drive/Sheets/Gemini
+    PARALLEL_CASES = 3
+
+    # El caché de fundamentos solo se crea si al menos esta cantidad de casos lo reutilizará
+    MIN_CACHE_REUSE_THRESHOLD = 3
+
+    # Sin caché de fundamentos, cachear explícitamente el prefijo fijo (instrucciones + prompt WAES)
+    ENABLE_EXPLICIT_CACHE = _ENV["ENABLE_EXPLICIT_CACHE"].lower() == "true"
+    PROMPT_CACHE_TTL_HOURS = 1
+
+    # 6. URLs de Documentación y Prompts
     URL_SYSTEM_INSTRUCTIONS = "https://docs.google.com/document/d/10A2RkozCS_HGl5L9b0YZO_NlLy_gA4Ou698XmH1Rzlc/edit?usp=sharing"
     URL_PROMPT_WAES = "https://docs.google.com/document/d/1kRdIgBTcZwEesJnEwvgz7GzVhEYe7jRj3Mod8QWAtTw/edit?usp=sharing"
+    # Segundos que se reutiliza el texto descargado de los prompts antes de volver a Drive
+    DOC_CACHE_TTL = 3600
 
     @classmethod
     def validate(cls):
         """Asegura que las variables críticas existan antes de arrancar según el modo."""
+        global _VALIDATED
+        if _VALIDATED:
+            return
+
         missing = []
         if not cls.SPREADSHEET_ID: missing.append("SPREADSHEET_ID")
         
@@ -73,12 +161,17 @@ class Config:
         
         if missing:
             raise ValueError(f"Faltan variables en el .env: {', '.join(missing)}")
+
+        # Sin perfil propio se usarían los tiempos de otra versión mientras la columna R registra esta
+        if cls.APP_VERSION not in PROFILES:
+            raise ValueError(
+                f"APP_VERSION '{cls.APP_VERSION}' no tiene perfil en PROFILES "
+                f"(disponibles: {', '.join(PROFILES)})"
+            )
         
-        if not cls.FUNDAMENTOS_DIR.exists():
-            try:
-                os.makedirs(cls.FUNDAMENTOS_DIR, exist_ok=True)
-            except Exception:
-                pass
+        _ensure_fundamentos(cls.FUNDAMENTOS_DIR)
+
+        _VALIDATED = True
 
 # Validar al importar
 Config.validate()
\ No newline at end of file
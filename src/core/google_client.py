@@ -1,17 +1,22 @@
 import os
 import logging
 import gspread
+import httplib2
+import threading
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.service_account import Credentials
 from google.oauth2.credentials import Credentials as OAuthCredentials
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import Request, AuthorizedSession
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
 from src.config import Config
 from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
+    wait_random,
     retry_if_exception_type,
     before_sleep_log
 )
@@ -41,13 +46,19 @@ class GoogleClientManager:
             return
         self._creds = None
         self._oauth_creds = None
-        self._drive_service = None
-        self._oauth_drive_service = None
         self._sheets_client = None
+        # httplib2.Http no es thread-safe: cada hilo (caso en paralelo) usa sus propios servicios de Drive
+        self._local = threading.local()
+        # Serializa la carga inicial de credenciales y clientes compartidos
+        self._lock = threading.RLock()
         self._initialized = True
 
     def _get_creds(self):
         """Carga las credenciales de la Service Account."""
+        with self._lock:
+            return self._load_creds()
+
+    def _load_creds(self):
         if not self._creds:
             try:
                 logger.info(f"Cargando credenciales desde: {Config.CREDENTIALS_FILE}")
@@ -65,22 +76,51 @@ class GoogleClientManager:
                 raise
         return self._creds
 
+    def _authorized_http(self, creds):
+        """
+        Transporte HTTP autenticado con timeout propio (en lugar de un timeout global de socket).
+        Cada servicio conserva su httplib2.Http: la conexión TLS se mantiene abierta entre llamadas.
+        """
+        return AuthorizedHttp(creds, http=httplib2.Http(timeout=Config.DRIVE_TIMEOUT_SECONDS))
+
+    def _build_drive(self, creds):
+        # Documento de discovery empaquetado con la librería: sin descarga ni caché en disco
+        return build('drive', 'v3', http=self._authorized_http(creds), cache_discovery=False)
+
     def get_drive_service(self):
-        """Retorna el servicio de Google Drive API v3."""
-        if not self._drive_service:
-            creds = self._get_creds()
-            self._drive_service = build('drive', 'v3', credentials=creds)
-        return self._drive_service
+        """Retorna el servicio de Google Drive API v3 del hilo actual."""
+        service = getattr(self._local, "drive_service", None)
+        if service is None:
+            service = self._build_drive(self._get_creds())
+            self._local.drive_service = service
+        return service
+
+    def get_authorized_session(self):
+        """
+        Sesión HTTP (requests) autenticada del hilo actual, para peticiones que la API
+        de Drive no expone, como descargas por rangos de bytes.
+        """
+        session = getattr(self._local, "authorized_session", None)
+        if session is None:
+            session = AuthorizedSession(self._get_creds())
+            self._local.authorized_session = session
+        return session
 
     def get_sheets_client(self):
         """Retorna el cliente de gspread para Sheets."""
-        if not self._sheets_client:
-            creds = self._get_creds()
-            self._sheets_client = gspread.authorize(creds)
+        with self._lock:
+            if not self._sheets_client:
+                creds = self._get_creds()
+                self._sheets_client = gspread.authorize(creds)
         return self._sheets_client
     
     def _get_oauth_creds(self):
         """Carga las credenciales OAuth del usuario (token.json)."""
+        # Con lock: un solo hilo refresca el token o abre el flujo OAuth en el navegador
+        with self._lock:
+            return self._load_oauth_creds()
+
+    def _load_oauth_creds(self):
         if not self._oauth_creds:
             try:
                 logger.info("Cargando credenciales OAuth desde token.json...")
@@ -132,11 +172,12 @@ class GoogleClientManager:
         return self._oauth_creds
     
     def get_oauth_drive_service(self):
-        """Retorna el servicio de Google Drive API v3 usando OAuth (usuario)."""
-        if not self._oauth_drive_service:
-            creds = self._get_oauth_creds()
-            self._oauth_drive_service = build('drive', 'v3', credentials=creds)
-        return self._oauth_drive_service
+        """Retorna el servicio de Google Drive API v3 usando OAuth (usuario), uno por hilo."""
+        service = getattr(self._local, "oauth_drive_service", None)
+        if service is None:
+            service = self._build_drive(self._get_oauth_creds())
+            self._local.oauth_drive_service = service
+        return service
     
     @retry(
         stop=stop_after_attempt(Config.MAX_RETRIES),
@@ -144,7 +185,7 @@ class GoogleClientManager:
             multiplier=1,
             min=Config.RETRY_MIN_WAIT,
             max=Config.RETRY_MAX_WAIT
-        ),
+        ) + wait_random(0, 2),
         retry=retry_if_exception_type((
             HttpError,
             GoogleAPIError,
@@ -158,7 +199,6 @@ class GoogleClientManager:
         Helper para subir archivos usando OAuth (usuario) para evitar
         problemas de cuota de almacenamiento con Service Accounts.
         """
-        from googleapiclient.http import MediaFileUpload
         # Usar OAuth Drive service en lugar de Service Account
         service = self.get_oauth_drive_service()
         
@@ -0,0 +1,61 @@
+import asyncio
+import functools
+import concurrent.futures
+
+class TransientLLMError(Exception):
+    """La respuesta de la IA llegó incompleta por causas del servicio (p. ej. stream cortado); reintentable."""
+
+# Errores locales que nunca se arreglan reintentando
+_PERMANENT_LOCAL_ERRORS = (FileNotFoundError, PermissionError, IsADirectoryError)
+
+# Errores de red/tiempo que sí vale la pena reintentar
+_TRANSIENT_LOCAL_ERRORS = (TransientLLMError, TimeoutError, ConnectionError, concurrent.futures.TimeoutError, asyncio.TimeoutError)
+
+@functools.lru_cache(maxsize=1)
+def _sdk_error_types():
+    """
+    Tipos de error de los SDKs, importados en el primer fallo y no al importar el módulo.
+    Se resuelven una sola vez: con casos en paralelo cada import repetido compite por el lock de imports.
+    """
+    from google.api_core import exceptions as core_exceptions
+    from google.genai import errors as genai_errors
+    import httpx
+
+    permanent = (
+        core_exceptions.PermissionDenied,
+        core_exceptions.Unauthenticated,
+        core_exceptions.NotFound,
+        core_exceptions.InvalidArgument
+    )
+    transient = (
+        core_exceptions.InternalServerError,
+        core_exceptions.ServiceUnavailable,
+        core_exceptions.TooManyRequests,
+        core_exceptions.DeadlineExceeded,
+        # google-genai expone sus propios errores HTTP (ServerError 5xx)
+        genai_errors.ServerError,
+        # Errores de transporte de httpx (usado por google-genai): timeouts, conexión reseteada
+        httpx.TransportError
+    )
+    return permanent, transient, genai_errors.ClientError
+
+def is_transient_error(exc):
+    """
+    Predicado para tenacity: True solo para fallos transitorios (timeouts, 429, 5xx, red).
+    Auth, NotFound, argumentos inválidos o bugs de código fallan de inmediato.
+    """
+    if isinstance(exc, _PERMANENT_LOCAL_ERRORS):
+        return False
+    if isinstance(exc, _TRANSIENT_LOCAL_ERRORS):
+        return True
+
+    permanent, transient, client_error = _sdk_error_types()
+    if isinstance(exc, permanent):
+        return False
+    if isinstance(exc, transient):
+        return True
+    # ClientError (4xx) de google-genai: solo 429 (cuota) es reintentable
+    if isinstance(exc, client_error):
+        return exc.code == 429
+
+    return False
@@ -1,16 +1,21 @@
 import os
 import logging
 import datetime
-import tempfile
-import shutil
+import threading
+import functools
+import uuid
+import concurrent.futures
 from src.config import Config
+from src.core.retry_policy import is_transient_error
+from src.utils.file_tools import read_pdf_bytes, read_pdf_bytes_cached
 from google import genai
 from google.genai import types
 from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
-    retry_if_exception_type,
+    wait_random,
+    retry_if_exception,
     before_sleep_log
 )
 
@@ -19,72 +24,187 @@ os.environ.setdefault("GRPC_DNS_RESOLVER", "native")
 
 logger = logging.getLogger(__name__)
 
+PDF_MIME_TYPE = "application/pdf"
+
+# Constructores de Parts PDF con el mime_type ya fijado (se usan por cada archivo)
+_pdf_part_from_bytes = functools.partial(types.Part.from_bytes, mime_type=PDF_MIME_TYPE)
+_pdf_part_from_uri = functools.partial(types.Part.from_uri, mime_type=PDF_MIME_TYPE)
+
 class AIClientWrapper:
+    """
+    Singleton que envuelve el cliente de Google GenAI (Vertex AI o Gemini API directa).
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AIClientWrapper, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
     def __init__(self):
+        if self._initialized:
+            return
         self.use_vertex = Config.USE_VERTEX_AI
-        # CAMBIO VITAL: Unificamos a gemini-2.5-pro para que coincida con chat_service.py
+        # CAMBIO VITAL: Unificamos a gemini-2.5-pro; chat_service.py toma el modelo de aquí
         self.model_name = "gemini-2.5-pro" 
-        
+        # Nombre sin prefijo 'models/' (el que se reporta en Sheets), calculado una sola vez
+        self.model_id = self.model_name.rsplit('models/', 1)[-1]
+
+        # Deadline explícito por petición HTTP (el SDK lo recibe en milisegundos).
+        # Sin retry_options el SDK no reintenta: la política la define tenacity.
+        http_options = types.HttpOptions(timeout=Config.API_TIMEOUT_SECONDS * 1000)
+
         # El nuevo SDK unifica la inicialización
         if self.use_vertex:
             self.client = genai.Client(
                 vertexai=True,
                 project=Config.PROJECT_ID,
-                location=Config.LOCATION
+                location=Config.LOCATION,
+                http_options=http_options
             )
             logger.info(f"Google GenAI Client (Vertex AI) inicializado en {Config.PROJECT_ID}.")
         else:
-            self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+            self.client = genai.Client(api_key=Config.GEMINI_API_KEY, http_options=http_options)
             logger.info("Google GenAI Client (Gemini API Directa) inicializado.")
 
+        self._staging_bucket = None
+        self._staging_lock = threading.Lock()
+        # Parts de PDFs estáticos reutilizados entre casos: (ruta, mtime_ns, tamaño) -> (Part, archivo_subido)
+        self._part_cache = {}
+        self._part_cache_lock = threading.Lock()
+        self._initialized = True
+
     @retry(
         stop=stop_after_attempt(4),
-        wait=wait_exponential(multiplier=2, min=5, max=60),
-        retry=retry_if_exception_type((Exception,)),
+        wait=wait_exponential(multiplier=2, min=5, max=60) + wait_random(0, 2),
+        retry=retry_if_exception(is_transient_error),
         before_sleep=before_sleep_log(logger, logging.WARNING)
     )
-    def _upload_file_with_retry(self, path):
-        """Sube el archivo a Gemini usando un nombre seguro para evadir el error Unicode de Windows."""
+    def _upload_file_with_retry(self, path, display_name):
+        """Sube el PDF a Gemini desde el archivo abierto."""
         logger.info(f"Subiendo archivo a Gemini API: {path}")
-        
-        # Trampa: Crear una copia temporal con nombre puramente ASCII (evita WinError Unicode)
-        temp_dir = tempfile.mkdtemp()
-        safe_path = os.path.join(temp_dir, "temp_safe_upload.pdf")
-        shutil.copy2(path, safe_path)
-        
-        try:
-            # Subimos el archivo con el nombre seguro, pero le decimos a Gemini su nombre original
-            uploaded_file = self.client.files.upload(
-                file=safe_path,
-                config=types.UploadFileConfig(
-                    display_name=os.path.basename(path) # Aquí sí acepta acentos sin explotar
-                )
+        # Se abre aquí y se entrega el handle: el SDK nunca toca la ruta (evita el WinError Unicode)
+        # y lee el archivo por partes. display_name sí acepta acentos sin explotar.
+        with open(path, "rb") as pdf_file:
+            return self.client.files.upload(
+                file=pdf_file,
+                config=types.UploadFileConfig(mime_type=PDF_MIME_TYPE, display_name=display_name)
             )
-            return uploaded_file
-        finally:
-            # Limpiamos el rastro
-            shutil.rmtree(temp_dir, ignore_errors=True)
 
-    def create_cache(self, cache_name, file_paths, system_instruction, ttl_hours=12):
+    @property
+    def staging_bucket(self):
+        """Bucket de GCS (Config.GCS_STAGING_BUCKET) para pasar PDFs a Vertex por URI."""
+        if self._staging_bucket is None:
+            with self._staging_lock:
+                if self._staging_bucket is None:
+                    from google.cloud import storage
+                    self._staging_bucket = storage.Client(project=Config.PROJECT_ID).bucket(Config.GCS_STAGING_BUCKET)
+        return self._staging_bucket
+
+    @retry(
+        stop=stop_after_attempt(4),
+        wait=wait_exponential(multiplier=2, min=5, max=60) + wait_random(0, 2),
+        retry=retry_if_exception(is_transient_error),
+        before_sleep=before_sleep_log(logger, logging.WARNING)
+    )
+    def _stage_to_gcs(self, path):
+        """Sube el PDF al bucket de staging; Vertex lo lee de ahí sin que el PDF viaje en la petición."""
+        blob = self.staging_bucket.blob(f"vawa-staging/{uuid.uuid4().hex}/{os.path.basename(path)}")
+        blob.upload_from_filename(path, content_type=PDF_MIME_TYPE, timeout=Config.API_TIMEOUT_SECONDS)
+        return blob
+
+    def prepare_pdf_part(self, path, display_name=None, reuse_bytes=False):
+        """
+        Convierte un PDF local en un Part: bytes en línea para Vertex (o URI gs:// si hay bucket
+        de staging), subida a la Files API para la API directa.
+        reuse_bytes memoiza la lectura (solo para PDFs que se repiten, como los fundamentos).
+        Retorna (part, subida o None); la subida se borra con delete_uploaded.
+        """
+        display_name = display_name or os.path.basename(path)
+        if self.use_vertex and Config.GCS_STAGING_BUCKET and not reuse_bytes:
+            # Con staging el PDF no se carga en memoria ni se copia al cuerpo de la petición
+            blob = self._stage_to_gcs(path)
+            logger.info(f"✅ Archivo en staging de GCS para Vertex: {display_name}")
+            return _pdf_part_from_uri(file_uri=f"gs://{blob.bucket.name}/{blob.name}"), blob
+
+        if self.use_vertex:
+            # En Vertex podemos mandar los bytes directamente en la petición
+            data = read_pdf_bytes_cached(path) if reuse_bytes else read_pdf_bytes(path)
+            logger.info(f"✅ Archivo leído localmente para Vertex: {display_name}")
+            return _pdf_part_from_bytes(data=data), None
+
+        # En la API directa requerimos subir el archivo
+        uploaded_file = self._upload_file_with_retry(path, display_name)
+        logger.info(f"✅ Subida exitosa confirmada: {display_name}")
+        return _pdf_part_from_uri(file_uri=uploaded_file.uri), uploaded_file
+
+    def delete_uploaded(self, uploaded):
+        """Borra una subida temporal de prepare_pdf_part (blob de GCS o archivo de la Files API)."""
+        if self.use_vertex:
+            uploaded.delete()
+        else:
+            self.client.files.delete(name=uploaded.name)
+
+    def get_shared_pdf_part(self, path):
+        """
+        Part reutilizable para un PDF que no cambia entre casos (fundamentos).
+        La clave (ruta, mtime_ns, tamaño) evita hashear el archivo; en la API directa
+        ahorra volver a subir el mismo PDF en cada caso.
+        """
+        stat = os.stat(path)
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        # El lock se mantiene durante la preparación: casos en paralelo no suben dos veces el mismo PDF
+        with self._part_cache_lock:
+            cached = self._part_cache.get(key)
+            if cached is None:
+                cached = self.prepare_pdf_part(path, reuse_bytes=True)
+                self._part_cache[key] = cached
+        return cached[0]
+
+    def release_shared_parts(self):
+        """Elimina de Gemini las subidas compartidas y vacía el registro de Parts."""
+        with self._part_cache_lock:
+            entries = list(self._part_cache.values())
+            self._part_cache.clear()
+
+        for _, uploaded_file in entries:
+            if uploaded_file is None:
+                continue
+            try:
+                self.delete_uploaded(uploaded_file)
+                logger.info(f"Archivo compartido {uploaded_file.name} eliminado.")
+            except Exception as e:
+                logger.warning(f"No se pudo eliminar el archivo compartido {uploaded_file.name}: {e}")
+
+    def create_cache(self, cache_name, file_paths, system_instruction, ttl_hours=12, texts=()):
+        """Crea un CachedContent con los PDFs de file_paths seguidos de los textos fijos de texts."""
         logger.info(f"Creando caché '{cache_name}' con {len(file_paths)} documentos. Modo Vertex: {self.use_vertex}. Modelo: {self.model_name}")
         
         parts = []
         uploaded_files = []
         
         try:
-            for path in file_paths:
-                if self.use_vertex:
-                    # En Vertex podemos mandar los bytes directamente en la petición
-                    with open(path, "rb") as f:
-                        data = f.read()
-                    parts.append(types.Part.from_bytes(data=data, mime_type="application/pdf"))
-                    logger.info(f"✅ Archivo leído localmente para Vertex: {os.path.basename(path)}")
-                else:
-                    # En la API directa requerimos subir el archivo
-                    uploaded_file = self._upload_file_with_retry(path)
+            # Las subidas son round-trips HTTPS independientes: se lanzan en paralelo
+            max_workers = max(1, min(Config.MAX_PARALLEL_UPLOADS, len(file_paths)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self.prepare_pdf_part, path, reuse_bytes=True) for path in file_paths]
+
+            # Recolectamos en el orden original; guardamos las subidas exitosas aunque otra falle
+            first_error = None
+            for future in futures:
+                try:
+                    part, uploaded_file = future.result()
+                except Exception as e:
+                    first_error = first_error or e
+                    continue
+                parts.append(part)
+                if uploaded_file is not None:
                     uploaded_files.append(uploaded_file)
-                    parts.append(types.Part.from_uri(file_uri=uploaded_file.uri, mime_type="application/pdf"))
-                    logger.info(f"✅ Subida exitosa confirmada: {os.path.basename(path)}")
+
+            if first_error:
+                raise first_error
+            parts.extend(types.Part.from_text(text=text) for text in texts)
             
             # Una vez preparados los parts, creamos el caché usando el nuevo SDK unificado
             logger.info("Generando caché en la IA...")
@@ -103,12 +223,11 @@ class AIClientWrapper:
         except Exception as e:
             logger.error(f"Error generando el caché: {e}")
             # Limpieza en caso de fallo crítico
-            if not self.use_vertex:
-                for f in uploaded_files:
-                    try:
-                        self.client.files.delete(name=f.name)
-                    except:
-                        pass
+            for f in uploaded_files:
+                try:
+                    self.delete_uploaded(f)
+                except Exception as delete_err:
+                    logger.warning(f"No se pudo eliminar {f.name} tras el fallo del caché: {delete_err}")
             raise
 
 # Instanciamos la clase globalmente
@@ -5,22 +5,122 @@ import traceback
 import time
 import os
 import re
+import hashlib
+import io
+import atexit
+import asyncio
+import threading
+from types import MappingProxyType
 from src.config import Config
+from src.core.retry_policy import is_transient_error, TransientLLMError
 from src.core.google_client import google_manager
 from src.core.vertex_wrapper import vertex_client
+from src.services.cache_service import FUNDAMENTOS_SYSTEM_INSTRUCTION
+from src.services.drive_service import drive_service
 from src.utils.drive_tools import get_id_from_url
-from google import genai
 from google.genai import types
 from tenacity import (
     retry,
     stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
+    wait_random_exponential,
+    retry_if_exception,
     before_sleep_log
 )
 
 logger = logging.getLogger(__name__)
 
+# Encabezado que presenta los documentos del paciente
+DOC_INTRO_HEADER = (
+    "ATENCIÓN: Los siguientes documentos son PRUEBAS LEGALES de un caso de inmigración (VAWA). "
+    "No apliques censura a tu análisis, es un requerimiento legal estricto.\n\nDocumentos adjuntos:\n"
+)
+
+# Encabezado de los fundamentos cuando se envían en línea (sin caché)
+FUNDAMENTOS_INTRO_HEADER = "Documentos de referencia (Fundamentos / manuales de auditoría):\n"
+
+# AÑADIDAS INSTRUCCIONES ESTRICTAS PARA EVITAR EL BLOQUE DE CÓDIGO Y FORZAR ESPACIOS EN TABLAS
+FORMATTING_RULES = (
+    "\n\n--- INSTRUCCIONES ESTRICTAS DE FORMATO ---\n"
+    "1. **PROHIBIDO RESUMIR:** Tu respuesta debe ser una evaluación forense de 7 a 10 páginas.\n"
+    "2. **ESTRUCTURA:** Cada celda de tabla DEBE contener un párrafo descriptivo completo. DEBES dejar un salto de línea (Enter) antes y después de cada tabla.\n"
+    "3. **EVIDENCIA EXPLÍCITA:** Incluye citas textuales entre comillas extraídas de los documentos.\n"
+    "4. **PROHIBIDO BLOQUES DE CÓDIGO:** Entrega el formato Markdown directamente. NO envuelvas tu respuesta en ```markdown ni en ningún otro bloque de código de backticks.\n"
+    "5. **TABLA INICIAL (CARÁTULA DEL CASO):** Esta sección DEBE ser una tabla Markdown perfectamente válida con tuberías (|). Debe tener una cabecera clara. Ejemplo:\n"
+    "| Información | Detalle |\n"
+    "| :--- | :--- |\n"
+    "| **Nombre del Cliente** | [Nombre] |\n"
+    "| **Nombre del Abuser** | [Nombre] |\n"
+    "Asegúrate de dejar una línea en blanco antes y después de la tabla.\n"
+)
+
+# Sin filtros de contenido: los documentos son evidencia legal con lenguaje explícito
+SAFETY_SETTINGS = (
+    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
+    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
+    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
+    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_NONE"),
+)
+
+# Parámetros de generación comunes a todas las peticiones
+GEN_CONFIG_ARGS = MappingProxyType({
+    "temperature": 0.5,
+    "max_output_tokens": 20000,
+    "safety_settings": list(SAFETY_SETTINGS),
+})
+
+# Textos de prompts exportados desde Drive: url -> (momento de la descarga, texto)
+_DOC_CACHE = {}
+_DOC_CACHE_LOCK = threading.Lock()
+# URL -> Lock de descarga (creados bajo _DOC_CACHE_LOCK)
+_DOC_FETCH_LOCKS = {}
+
+# Event loop de fondo para el cliente asíncrono de Gemini. Es uno solo y vive todo el proceso:
+# el cliente httpx asíncrono del SDK queda ligado al loop donde se usó por primera vez.
+_ASYNC_LOOP = None
+_ASYNC_LOOP_LOCK = threading.Lock()
+
+def _get_async_loop():
+    """Arranca (una vez) el hilo con el event loop donde corren los streams de Gemini."""
+    global _ASYNC_LOOP
+    with _ASYNC_LOOP_LOCK:
+        if _ASYNC_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="gemini-aio", daemon=True).start()
+            atexit.register(loop.call_soon_threadsafe, loop.stop)
+            _ASYNC_LOOP = loop
+    return _ASYNC_LOOP
+
+# Marca de fin de stream en la cola productor/consumidor
+_STREAM_END = object()
+
+# Cada cuántos caracteres recibidos se reporta el progreso del stream
+STREAM_PROGRESS_LOG_CHARS = 5000
+
+# Cachés explícitos del prefijo fijo del prompt: hash del contenido -> (vencimiento monotónico, nombre)
+_PROMPT_CACHES = {}
+_PROMPT_CACHES_LOCK = threading.Lock()
+
+# IDs de los Docs de prompts, extraídos una sola vez de las URLs fijas de Config
+_PROMPT_FILE_IDS = {
+    url: get_id_from_url(url)
+    for url in (Config.URL_SYSTEM_INSTRUCTIONS, Config.URL_PROMPT_WAES)
+}
+
+# Recurso files() de Drive, construido una vez por hilo y reutilizado en cada exportación
+_drive_local = threading.local()
+
+def _export_doc_text(url):
+    """Exporta un Google Doc a texto plano."""
+    drive_files = getattr(_drive_local, "files", None)
+    if drive_files is None:
+        drive_files = _drive_local.files = google_manager.get_drive_service().files()
+    file_id = _PROMPT_FILE_IDS.get(url) or get_id_from_url(url)
+    response = drive_files.export(
+        fileId=file_id,
+        mimeType="text/plain"
+    ).execute()
+    return response.decode('utf-8')
+
 class ChatService:
     """
     Gestiona la ejecución de prompts con un Paginador/Auto-Continuador.
@@ -28,124 +128,244 @@ class ChatService:
     """
 
     def __init__(self):
-        self.drive_service = google_manager.get_drive_service()
-        self.client = vertex_client.client 
+        # Una instancia por caso: los casos en paralelo no comparten estado de sesión
         self.chat_session = False
         self.uploaded_files = [] 
-        self.model_name = "gemini-2.5-pro"
+        # Mismo modelo que el caché (un cachedContent solo sirve para el modelo con el que se creó)
+        self.model_name = vertex_client.model_id
         self.system_instruction = ""
         self.cache_name = None
+        # True cuando cache_name ya contiene las instrucciones y el prompt WAES
+        self.prompt_cached = False
+        self.gen_config = None
+        self.fundamentos_files = []
 
-    def _fetch_doc_text(self, url):
+    @property
+    def client(self):
+        """Cliente GenAI compartido del wrapper."""
+        return vertex_client.client
+
+    @staticmethod
+    def warm_up():
+        """
+        Abre de antemano la conexión del cliente asíncrono (el que usan las peticiones de grading)
+        con una llamada barata (count_tokens) en el loop compartido. Los errores solo se registran.
+        """
         try:
-            file_id = get_id_from_url(url)
-            response = self.drive_service.files().export(
-                fileId=file_id,
-                mimeType="text/plain"
-            ).execute()
-            return response.decode('utf-8')
+            future = asyncio.run_coroutine_threadsafe(
+                vertex_client.client.aio.models.count_tokens(model=vertex_client.model_name, contents="ping"),
+                _get_async_loop()
+            )
+            future.result(timeout=Config.API_TIMEOUT_SECONDS)
+            logger.info("Conexión con la IA precalentada.")
         except Exception as e:
-            logger.error(f"Error leyendo prompt desde {url}: {e}")
-            raise
+            logger.warning(f"No se pudo precalentar la conexión con la IA: {e}")
+
+    @classmethod
+    def clear_cache(cls):
+        """Descarta los prompts cacheados (útil en procesos largos si se editan los Docs)."""
+        with _DOC_CACHE_LOCK:
+            _DOC_CACHE.clear()
+
+    @classmethod
+    def _fetch_doc_text(cls, url):
+        """Texto del Doc memoizado por URL durante Config.DOC_CACHE_TTL segundos."""
+        cached = cls._cached_doc_text(url)
+        if cached is not None:
+            return cached
+        # Un lock por URL: si varios casos piden el mismo Doc a la vez, solo uno lo exporta,
+        # pero Docs distintos se descargan en paralelo
+        with _DOC_CACHE_LOCK:
+            url_lock = _DOC_FETCH_LOCKS.setdefault(url, threading.Lock())
+        with url_lock:
+            cached = cls._cached_doc_text(url)
+            if cached is not None:
+                return cached
+            try:
+                text = _export_doc_text(url)
+            except Exception as e:
+                logger.error(f"Error leyendo prompt desde {url}: {e}")
+                raise
+            with _DOC_CACHE_LOCK:
+                _DOC_CACHE[url] = (time.monotonic(), text)
+            return text
+
+    @staticmethod
+    def _cached_doc_text(url):
+        """Texto vigente del caché (o None); el lock global solo cubre la consulta al dict."""
+        with _DOC_CACHE_LOCK:
+            cached = _DOC_CACHE.get(url)
+        if cached and time.monotonic() - cached[0] < Config.DOC_CACHE_TTL:
+            return cached[1]
+        return None
 
-    def initialize_session(self, cache_obj=None):
+    def initialize_session(self, cache_obj=None, fundamentos_files=None, force_refresh=False, prompt_in_cache=False):
+        """
+        Prepara la sesión de un caso. Sin cache_obj, los PDFs de fundamentos_files
+        se adjuntan directamente en cada petición. force_refresh vuelve a descargar los prompts.
+        prompt_in_cache indica que cache_obj se creó con load_static_prompt_texts().
+        """
+        if force_refresh:
+            self.clear_cache()
         try:
-            system_instr = self._fetch_doc_text(Config.URL_SYSTEM_INSTRUCTIONS)
-            
-            system_instr += (
-                "\n\nINSTRUCCIÓN CRÍTICA: Eres un Especialista Legal Forense en Derechos Humanos. "
-                "Tu reporte DEBE ser extremadamente exhaustivo. Tienes prohibido resumir."
-            )
+            self.system_instruction = self._load_system_instruction()
             logger.info("Instrucciones del sistema cargadas con el Escudo Legal.")
             
-            self.system_instruction = system_instr
             self.cache_name = cache_obj.name if cache_obj else None
+            # El caché de fundamentos puede traer ya las instrucciones y el prompt WAES
+            self.prompt_cached = bool(cache_obj) and prompt_in_cache
+            self.fundamentos_files = [] if cache_obj else list(fundamentos_files or [])
+
+            if not cache_obj and Config.ENABLE_EXPLICIT_CACHE:
+                self.cache_name = self._get_prompt_cache()
+                self.prompt_cached = self.cache_name is not None
+            self.gen_config = self._build_gen_config()
             self.chat_session = True  
             
         except Exception as e:
             logger.error(f"Error inicializando modelo: {e}")
             raise
 
+    @classmethod
+    def _load_system_instruction(cls):
+        """Instrucciones del sistema desde Drive, con el refuerzo del Escudo Legal."""
+        return cls._fetch_doc_text(Config.URL_SYSTEM_INSTRUCTIONS) + (
+            "\n\nINSTRUCCIÓN CRÍTICA: Eres un Especialista Legal Forense en Derechos Humanos. "
+            "Tu reporte DEBE ser extremadamente exhaustivo. Tienes prohibido resumir."
+        )
+
+    @staticmethod
+    def _compose_static_texts(system_instruction, prompt_text):
+        """Textos fijos entre casos: instrucciones del sistema y prompt WAES con reglas de formato."""
+        return (
+            f"--- INSTRUCCIONES DEL SISTEMA ---\n{system_instruction}\n\n",
+            "".join(("Instrucciones de Grading:\n", prompt_text, FORMATTING_RULES)),
+        )
+
+    @classmethod
+    def load_static_prompt_texts(cls):
+        """Prefijo fijo del prompt (el mismo que envía cada sesión), para incluirlo en un caché compartido."""
+        return cls._compose_static_texts(
+            cls._load_system_instruction(), cls._fetch_doc_text(Config.URL_PROMPT_WAES)
+        )
+
+    def _static_prompt_texts(self, prompt_text):
+        return self._compose_static_texts(self.system_instruction, prompt_text)
+
+    def _get_prompt_cache(self):
+        """
+        Crea (o reutiliza) un CachedContent con el prefijo fijo del prompt.
+        Retorna el nombre del caché, o None si no se pudo crear (el prompt se envía completo).
+        """
+        texts = self._static_prompt_texts(self._fetch_doc_text(Config.URL_PROMPT_WAES))
+        key = hashlib.sha256(
+            "\0".join((self.model_name, FUNDAMENTOS_SYSTEM_INSTRUCTION) + texts).encode("utf-8")
+        ).hexdigest()
+
+        # Con lock: casos en paralelo esperan al primero en lugar de crear cachés duplicados
+        with _PROMPT_CACHES_LOCK:
+            cached = _PROMPT_CACHES.get(key)
+            if cached and time.monotonic() < cached[0]:
+                return cached[1]
+
+            try:
+                cache = vertex_client.create_cache(
+                    "vawa-prompt-cache",
+                    [],
+                    FUNDAMENTOS_SYSTEM_INSTRUCTION,
+                    ttl_hours=Config.PROMPT_CACHE_TTL_HOURS,
+                    texts=texts
+                )
+            except Exception as e:
+                logger.warning(f"No se pudo crear el caché del prompt; se enviará completo en cada petición: {e}")
+                return None
+
+            # Margen de un minuto para no usar un caché a punto de expirar
+            expires_at = time.monotonic() + Config.PROMPT_CACHE_TTL_HOURS * 3600 - 60
+            _PROMPT_CACHES[key] = (expires_at, cache.name)
+            return cache.name
+
     def execute_grading_flow(self, patient_files_tuple):
         if not self.chat_session:
             raise ValueError("La sesión de chat no ha sido inicializada.")
         
         uploaded_parts = []
+        fundamentos_parts = []
         
         try:
-            for doc_type, path in patient_files_tuple:
-                if Config.USE_VERTEX_AI:
-                    with open(path, "rb") as f:
-                        data = f.read()
-                    uploaded_parts.append((doc_type, types.Part.from_bytes(data=data, mime_type="application/pdf")))
-                else:
-                    logger.info(f"Subiendo {doc_type} a Gemini API...")
-                    import io
-                    with open(path, "rb") as f_in:
-                        data = f_in.read()
-                    gemini_file = self.client.files.upload(
-                        file=io.BytesIO(data),
-                        config={'mime_type': 'application/pdf', 'display_name': doc_type}
-                    )
-                    part_obj = types.Part.from_uri(file_uri=gemini_file.uri, mime_type="application/pdf")
-                    uploaded_parts.append((doc_type, part_obj))
-                    self.uploaded_files.append(gemini_file)
-
-            return self._execute_with_auto_continue(uploaded_parts)
+            # Lectura de disco + subida de cada PDF en paralelo (round-trips independientes);
+            # map conserva el orden original de los documentos
+            doc_types = [doc_type for doc_type, _ in patient_files_tuple]
+            max_workers = max(1, min(Config.MAX_PARALLEL_UPLOADS, len(doc_types)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # El prompt WAES se descarga de Drive mientras se suben los PDFs (si no está ya en caché)
+                prompt_future = None
+                if not self.prompt_cached:
+                    # En el pool de Drive: sus hilos ya tienen servicio y conexión abiertos
+                    prompt_future = drive_service.submit(self._fetch_doc_text, Config.URL_PROMPT_WAES)
+                parts = list(executor.map(lambda item: self._prepare_part(*item), patient_files_tuple))
+            uploaded_parts.extend(zip(doc_types, parts))
+            prompt_text = prompt_future.result() if prompt_future else None
+
+            # Sin caché, los fundamentos viajan en línea junto a los documentos del caso.
+            # Sus Parts se comparten entre casos (no se re-leen ni re-suben cada vez).
+            for path in self.fundamentos_files:
+                fundamentos_parts.append((os.path.basename(path), vertex_client.get_shared_pdf_part(path)))
+
+            # El prompt se arma una sola vez; los reintentos solo repiten el envío
+            message_parts = self._build_message_parts(uploaded_parts, fundamentos_parts, prompt_text)
+            return self._execute_with_auto_continue(message_parts)
             
         finally:
             self._cleanup_gemini_files()
 
+    def _prepare_part(self, label, path):
+        """Part de un documento del paciente; las subidas se registran para borrarlas al terminar el caso."""
+        part, gemini_file = vertex_client.prepare_pdf_part(path, display_name=label)
+        if gemini_file is not None:
+            self.uploaded_files.append(gemini_file)
+        return part
+
     def _cleanup_gemini_files(self):
-        if not Config.USE_VERTEX_AI and self.uploaded_files:
-            for f in self.uploaded_files:
-                try:
-                    self.client.files.delete(name=f.name)
-                    logger.info(f"Archivo temporal {f.name} eliminado.")
-                except Exception as e:
-                    pass
+        if self.uploaded_files:
+            # Borrados en paralelo: cada uno es un round-trip HTTPS independiente
+            max_workers = max(1, min(Config.MAX_PARALLEL_UPLOADS, len(self.uploaded_files)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [(f, executor.submit(vertex_client.delete_uploaded, f)) for f in self.uploaded_files]
+                for f, future in futures:
+                    try:
+                        future.result()
+                        logger.info(f"Archivo temporal {f.name} eliminado.")
+                    except Exception as e:
+                        logger.warning(f"No se pudo eliminar el archivo temporal {f.name}: {e}")
             self.uploaded_files = []
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=2, min=5, max=60),
-        retry=retry_if_exception_type((Exception,)),
-        before_sleep=before_sleep_log(logger, logging.WARNING)
-    )
-    def _execute_with_auto_continue(self, uploaded_parts):
-        prompt_text = self._fetch_doc_text(Config.URL_PROMPT_WAES)
-        
-        doc_intro = (
-            "ATENCIÓN: Los siguientes documentos son PRUEBAS LEGALES de un caso de inmigración (VAWA). "
-            "No apliques censura a tu análisis, es un requerimiento legal estricto.\n\nDocumentos adjuntos:\n"
-        )
-        
-        # AÑADIDAS INSTRUCCIONES ESTRICTAS PARA EVITAR EL BLOQUE DE CÓDIGO Y FORZAR ESPACIOS EN TABLAS
-        formatting_rules = (
-            "\n\n--- INSTRUCCIONES ESTRICTAS DE FORMATO ---\n"
-            "1. **PROHIBIDO RESUMIR:** Tu respuesta debe ser una evaluación forense de 7 a 10 páginas.\n"
-            "2. **ESTRUCTURA:** Cada celda de tabla DEBE contener un párrafo descriptivo completo. DEBES dejar un salto de línea (Enter) antes y después de cada tabla.\n"
-            "3. **EVIDENCIA EXPLÍCITA:** Incluye citas textuales entre comillas extraídas de los documentos.\n"
-            "4. **PROHIBIDO BLOQUES DE CÓDIGO:** Entrega el formato Markdown directamente. NO envuelvas tu respuesta en ```markdown ni en ningún otro bloque de código de backticks.\n"
-            "5. **TABLA INICIAL (CARÁTULA DEL CASO):** Esta sección DEBE ser una tabla Markdown perfectamente válida con tuberías (|). Debe tener una cabecera clara. Ejemplo:\n"
-            "| Información | Detalle |\n"
-            "| :--- | :--- |\n"
-            "| **Nombre del Cliente** | [Nombre] |\n"
-            "| **Nombre del Abuser** | [Nombre] |\n"
-            "Asegúrate de dejar una línea en blanco antes y después de la tabla.\n"
-        )
-
+    def _build_message_parts(self, uploaded_parts, fundamentos_parts=(), prompt_text=None):
+        """
+        Arma los Parts del primer mensaje. Lo fijo entre casos va primero (instrucciones, prompt WAES,
+        fundamentos) y los documentos del paciente al final, para que el prefijo idéntico aproveche
+        el caché implícito de Gemini. Si el prefijo está en el caché del prompt, no se reenvía.
+        prompt_text permite pasar el prompt WAES ya descargado.
+        """
         parts_1 = []
-        parts_1.append(types.Part.from_text(text=f"--- INSTRUCCIONES DEL SISTEMA ---\n{self.system_instruction}\n\n"))
-        parts_1.append(types.Part.from_text(text=doc_intro))
+        if not self.prompt_cached:
+            if prompt_text is None:
+                prompt_text = self._fetch_doc_text(Config.URL_PROMPT_WAES)
+            parts_1.extend(types.Part.from_text(text=text) for text in self._static_prompt_texts(prompt_text))
+        if fundamentos_parts:
+            parts_1.append(types.Part.from_text(text=FUNDAMENTOS_INTRO_HEADER))
+            for name, part_obj in fundamentos_parts:
+                parts_1.extend((types.Part.from_text(text=f"- Fundamento: '{name}'\n"), part_obj))
+        parts_1.append(types.Part.from_text(text=DOC_INTRO_HEADER))
         for doc_type, part_obj in uploaded_parts:
-            parts_1.append(types.Part.from_text(text=f"- Archivo: '{doc_type}.pdf'\n"))
-            parts_1.append(part_obj)
-        parts_1.append(types.Part.from_text(text=f"Instrucciones de Grading:\n{prompt_text}{formatting_rules}"))
+            parts_1.extend((types.Part.from_text(text=f"- Archivo: '{doc_type}.pdf'\n"), part_obj))
+        return parts_1
 
-        contents = [types.Content(role="user", parts=parts_1)]
+    def _execute_with_auto_continue(self, message_parts):
+        contents = [types.Content(role="user", parts=message_parts)]
         
-        full_markdown = ""
+        # Fragmentos por ciclo; se unen una sola vez al final (evita concatenación cuadrática)
+        markdown_parts = []
         total_in_tokens = 0
         total_out_tokens = 0
         max_cycles = 4
@@ -153,20 +373,13 @@ class ChatService:
         for cycle in range(1, max_cycles + 1):
             logger.info(f"🔄 Ciclo de generación {cycle}/{max_cycles} (Modelo: {self.model_name})...")
             
-            response, token_counts, finish_reason = self._raw_send_to_gemini(contents)
-            text = ""
-            
-            try:
-                text = response.text
-            except:
-                if response.candidates and response.candidates[0].content:
-                    text = response.candidates[0].content.parts[0].text
+            text, token_counts, finish_reason = self._send_with_retry(contents)
 
             if not text:
                 logger.error(f"❌ La API devolvió una respuesta vacía en el ciclo {cycle}. FinishReason: {finish_reason}")
                 break
                 
-            full_markdown += text + "\n\n"
+            markdown_parts.append(text)
             total_out_tokens += token_counts.get("output", 0)
             total_in_tokens = max(total_in_tokens, token_counts.get("input", 0))
 
@@ -185,7 +398,7 @@ class ChatService:
                 break
 
         # LIMPIEZA FINAL DE BACKTICKS (Sanitización manual por si la IA nos ignoró)
-        full_markdown = full_markdown.strip()
+        full_markdown = "\n\n".join(markdown_parts).strip()
         # Borra ```markdown o ``` del inicio
         full_markdown = re.sub(r"^```(?:markdown|md)?\s*", "", full_markdown, flags=re.IGNORECASE)
         # Borra ``` del final
@@ -193,52 +406,162 @@ class ChatService:
 
         return full_markdown.strip(), {"input": total_in_tokens, "output": total_out_tokens}, self.model_name
 
+    # Única capa de reintentos para la IA: cubre una sola petición, así un fallo en el
+    # ciclo N no repite los ciclos ya completados (el SDK de google-genai no reintenta por su cuenta)
+    @retry(
+        stop=stop_after_attempt(3),
+        # Backoff exponencial con jitter completo: casos concurrentes no reintentan a la vez
+        wait=wait_random_exponential(multiplier=2, min=5, max=60),
+        retry=retry_if_exception(is_transient_error),
+        before_sleep=before_sleep_log(logger, logging.WARNING)
+    )
+    def _send_with_retry(self, contents):
+        return self._raw_send_to_gemini(contents)
+
+    def _build_gen_config(self):
+        """Configuración de generación de la sesión (solo varía según haya caché o no)."""
+        if self.cache_name:
+            return types.GenerateContentConfig(**GEN_CONFIG_ARGS, cached_content=self.cache_name)
+        # Sin caché, la instrucción de identidad de los fundamentos va en la propia petición
+        return types.GenerateContentConfig(**GEN_CONFIG_ARGS, system_instruction=FUNDAMENTOS_SYSTEM_INSTRUCTION)
+
     def _raw_send_to_gemini(self, contents):
         timeout_val = Config.API_TIMEOUT_SECONDS
-        
-        safety_settings = [
-            types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
-            types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
-            types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
-            types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_NONE"),
-        ]
-
-        config_args = {
-            "temperature": 0.5, 
-            "max_output_tokens": 20000,
-            "safety_settings": safety_settings,
-        }
+        gen_config = self.gen_config
 
-        if self.cache_name:
-            config_args["cached_content"] = self.cache_name
+        if Config.USE_STREAMING:
+            request = self._collect(self._stream_chunks(contents, gen_config))
+        else:
+            request = self._generate_once(contents, gen_config)
+        # wait_for cancela la petición de verdad al vencer el timeout (cierra la conexión HTTP)
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(request, timeout=timeout_val),
+            _get_async_loop()
+        )
+        text, token_counts, finish_reason = future.result()
 
-        gen_config = types.GenerateContentConfig(**config_args)
+        if text and not token_counts["output"]:
+            # Algunos streams cortados no traen usage_metadata: se cuenta con el tokenizador del modelo
+            token_counts["output"] = self._count_output_tokens(text)
+        return text, token_counts, finish_reason
 
-        def make_request():
-            return self.client.models.generate_content(
-                model=self.model_name,
-                contents=contents,
-                config=gen_config
-            )
+    def _count_output_tokens(self, text):
+        """Tokens de un texto según el modelo; si count_tokens falla, estimación de ~4 caracteres por token."""
+        try:
+            return self.client.models.count_tokens(model=self.model_name, contents=text).total_tokens or 0
+        except Exception as e:
+            logger.warning(f"No se pudo contar tokens con el modelo, se estima por longitud: {e}")
+            return max(1, len(text) // 4)
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(make_request)
-            try:
-                response = future.result(timeout=timeout_val)
-                
-                finish_reason = "UNKNOWN"
-                if response.candidates and len(response.candidates) > 0:
-                    cand = response.candidates[0]
-                    if cand.finish_reason:
-                        finish_reason = str(cand.finish_reason)
-                
-                in_tokens = getattr(response.usage_metadata, 'prompt_token_count', 0) if response.usage_metadata else 0
-                out_tokens = getattr(response.usage_metadata, 'candidates_token_count', 0) if response.usage_metadata else 0
-                    
-                return response, {"input": in_tokens, "output": out_tokens}, finish_reason
+    async def _generate_once(self, contents, gen_config):
+        """Petición sin streaming: retorna (texto, tokens, finish_reason) de una respuesta completa."""
+        response = await self.client.aio.models.generate_content(
+            model=self.model_name,
+            contents=contents,
+            config=gen_config
+        )
+        finish_reason = self._blocked_reason(response) or "UNKNOWN"
+        if response.candidates and response.candidates[0].finish_reason:
+            finish_reason = str(response.candidates[0].finish_reason)
+        text = response.text or ""
+        if not text and finish_reason == "UNKNOWN":
+            raise TransientLLMError("Gemini respondió sin contenido ni finish_reason.")
+        return text, self._token_counts(response.usage_metadata), finish_reason
+
+    @staticmethod
+    def _blocked_reason(response):
+        """Motivo de bloqueo del prompt (prompt_feedback.block_reason) o None. Es permanente: no se reintenta."""
+        feedback = response.prompt_feedback
+        if feedback and feedback.block_reason:
+            return f"PROMPT_BLOCKED ({feedback.block_reason})"
+        return None
+
+    @staticmethod
+    def _token_counts(usage):
+        """Tokens de entrada/salida de usage_metadata (loggea cuántos vinieron del caché)."""
+        in_tokens = (usage.prompt_token_count or 0) if usage else 0
+        out_tokens = (usage.candidates_token_count or 0) if usage else 0
+        cached_tokens = (usage.cached_content_token_count or 0) if usage else 0
+        logger.info(f"Tokens de entrada servidos desde caché: {cached_tokens}/{in_tokens}")
+        return {"input": in_tokens, "output": out_tokens}
+
+    async def _stream_chunks(self, contents, gen_config):
+        """
+        Generador asíncrono: produce cada fragmento de texto apenas llega y, al final,
+        una tupla (finish_reason, {"input", "output"}) con el cierre del stream.
+        """
+        # Streaming asíncrono: ningún hilo queda bloqueado mientras el modelo genera
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model_name,
+            contents=contents,
+            config=gen_config
+        )
 
+        # Productor/consumidor: una tarea solo recibe chunks de la red y los encola; aquí se procesan.
+        # La cola acotada aplica contrapresión si quien consume se atrasa.
+        queue = asyncio.Queue(maxsize=64)
+
+        async def produce():
+            try:
+                async for raw_chunk in stream:
+                    await queue.put(raw_chunk)
             except Exception as e:
-                raise e
+                await queue.put(e)
+            else:
+                await queue.put(_STREAM_END)
+
+        producer = asyncio.create_task(produce())
+        finish_reason = "UNKNOWN"
+        usage = None
+        # Progreso con contador acumulado (O(1) por chunk); se loggea cada STREAM_PROGRESS_LOG_CHARS
+        total_chars = 0
+        next_log_at = STREAM_PROGRESS_LOG_CHARS
+        try:
+            while True:
+                # Un stream que deja de enviar chunks se corta aquí, sin esperar al timeout total
+                try:
+                    chunk = await asyncio.wait_for(queue.get(), timeout=Config.STREAM_CHUNK_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    raise TransientLLMError(
+                        f"El stream de Gemini no envió datos en {Config.STREAM_CHUNK_TIMEOUT_SECONDS}s."
+                    ) from None
+                if chunk is _STREAM_END:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                chunk_text = chunk.text
+                if chunk_text:
+                    total_chars += len(chunk_text)
+                    if total_chars >= next_log_at:
+                        logger.info(f"⏳ Recibiendo respuesta... {total_chars} caracteres hasta ahora.")
+                        next_log_at = total_chars + STREAM_PROGRESS_LOG_CHARS
+                    yield chunk_text
+                if chunk.candidates and chunk.candidates[0].finish_reason:
+                    finish_reason = str(chunk.candidates[0].finish_reason)
+                elif finish_reason == "UNKNOWN":
+                    # Un prompt bloqueado llega sin candidates, solo con prompt_feedback
+                    finish_reason = self._blocked_reason(chunk) or finish_reason
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+        finally:
+            # Si el consumo se cancela (timeout) o falla, el productor no debe quedar leyendo la red
+            producer.cancel()
+
+        yield finish_reason, self._token_counts(usage)
+
+    @staticmethod
+    async def _collect(chunk_stream):
+        """Consume _stream_chunks y retorna (texto, tokens, finish_reason) como una respuesta completa."""
+        buffer = io.StringIO()
+        finish_reason, token_counts = "UNKNOWN", {"input": 0, "output": 0}
+        async for piece in chunk_stream:
+            if isinstance(piece, tuple):
+                finish_reason, token_counts = piece
+            else:
+                buffer.write(piece)
 
-# INSTANCIA GLOBAL
-chat_service = ChatService()
\ No newline at end of file
+        text = buffer.getvalue()
+        if not text and finish_reason == "UNKNOWN":
+            # El stream terminó sin texto ni motivo de cierre: la conexión se cortó a medias
+            raise TransientLLMError("El stream de Gemini terminó sin contenido ni finish_reason.")
+        return text, token_counts, finish_reason
\ No newline at end of file
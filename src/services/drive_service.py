@@ -1,6 +1,12 @@
 import io
+import os
+import shutil
 import logging
+import tempfile
+import threading
+import concurrent.futures
 import docx
+import requests
 from googleapiclient.http import MediaIoBaseDownload  # <-- CORREGIDO AQUÍ
 from googleapiclient.errors import HttpError
 from fpdf import FPDF
@@ -10,6 +16,7 @@ from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
+    wait_random,
     retry_if_exception_type,
     before_sleep_log
 )
@@ -26,9 +33,31 @@ class DriveService:
     Servicio encargado de descargar y normalizar archivos de Drive a PDF.
     Cumple la regla: Todo input debe convertirse a PDF para el contexto de Vertex.
     """
-    
+
     def __init__(self):
-        self.service = google_manager.get_drive_service()
+        # file_id -> (copia local, modifiedTime de Drive al descargarlo). Solo dura una corrida:
+        # son documentos de pacientes y se borran en clear_pdf_cache()
+        self._pdf_cache = {}
+        self._pdf_cache_dir = None
+        self._pdf_cache_lock = threading.Lock()
+        # Pools de larga vida: el servicio de Drive y la AuthorizedSession son por hilo
+        # (google_manager), así que solo se reutilizan (con su conexión TLS) si los hilos persisten.
+        # Las descargas por rangos van a un pool aparte: una descarga espera a sus rangos.
+        self._download_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=Config.DRIVE_DOWNLOAD_WORKERS, thread_name_prefix="drive"
+        )
+        self._range_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=Config.DRIVE_RANGE_WORKERS, thread_name_prefix="rango"
+        )
+    
+    def submit(self, fn, *args):
+        """Ejecuta una llamada a Drive en el pool compartido; retorna un Future."""
+        return self._download_executor.submit(fn, *args)
+
+    @property
+    def service(self):
+        """Servicio de Drive del hilo actual (los casos pueden procesarse en paralelo)."""
+        return google_manager.get_drive_service()
 
     @retry(
         stop=stop_after_attempt(Config.MAX_RETRIES),
@@ -36,7 +65,7 @@ class DriveService:
             multiplier=1,
             min=Config.RETRY_MIN_WAIT,
             max=Config.RETRY_MAX_WAIT
-        ),
+        ) + wait_random(0, 2),
         retry=retry_if_exception_type((
             HttpError,
             GoogleAPIError,
@@ -50,7 +79,7 @@ class DriveService:
         try:
             file = self.service.files().get(
                 fileId=file_id, 
-                fields="id, name, mimeType"
+                fields="id, name, mimeType, modifiedTime, size"
             ).execute()
             return file
         except HttpError as e:
@@ -63,7 +92,7 @@ class DriveService:
             multiplier=1,
             min=Config.RETRY_MIN_WAIT,
             max=Config.RETRY_MAX_WAIT
-        ),
+        ) + wait_random(0, 2),
         retry=retry_if_exception_type((
             HttpError,
             GoogleAPIError,
@@ -82,6 +111,15 @@ class DriveService:
             mime_type = meta.get('mimeType')
             name = meta.get('name')
             
+            modified_time = meta.get('modifiedTime')
+
+            # Si el archivo no cambió en Drive desde la última descarga, se copia la versión local
+            cached_path = self._get_cached_pdf(file_id, modified_time)
+            if cached_path:
+                shutil.copyfile(cached_path, output_path)
+                logger.info(f"Archivo sin cambios en Drive, reutilizado desde caché local: {name}")
+                return output_path
+
             logger.info(f"Procesando archivo: {name} ({mime_type})")
 
             # CASO 1: Google Docs (Nativos) -> Exportar a PDF
@@ -94,8 +132,7 @@ class DriveService:
 
             # CASO 2: PDF Real -> Descargar directo
             elif mime_type == 'application/pdf':
-                request = self.service.files().get_media(fileId=file_id)
-                self._execute_download(request, output_path)
+                self._download_media(file_id, meta.get('size'), output_path)
 
             # CASO 3: Word (.docx) -> Descargar binario -> Convertir a PDF
             elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
@@ -128,16 +165,102 @@ class DriveService:
             else:
                 logger.warning(f"Tipo no soportado nativamente: {mime_type}. Intentando descarga binaria...")
                 # Fallback: intentar descargar tal cual
-                request = self.service.files().get_media(fileId=file_id)
-                self._execute_download(request, output_path)
+                self._download_media(file_id, meta.get('size'), output_path)
 
             logger.info(f"Archivo guardado exitosamente: {output_path}")
+            self._store_cached_pdf(file_id, modified_time, output_path)
             return output_path
 
         except Exception as e:
             logger.error(f"Fallo al procesar {file_id}: {e}")
             raise
 
+    def _get_cached_pdf(self, file_id, modified_time):
+        """Ruta del PDF cacheado si corresponde a la misma versión del archivo en Drive."""
+        if not modified_time:
+            return None
+        with self._pdf_cache_lock:
+            entry = self._pdf_cache.get(file_id)
+        if entry and entry[1] == modified_time and os.path.exists(entry[0]):
+            return entry[0]
+        return None
+
+    def _store_cached_pdf(self, file_id, modified_time, output_path):
+        """Guarda una copia del PDF descargado; un fallo aquí no afecta al caso."""
+        if not modified_time:
+            return
+        try:
+            with self._pdf_cache_lock:
+                if self._pdf_cache_dir is None:
+                    self._pdf_cache_dir = tempfile.mkdtemp(prefix="vawa_pdf_cache_")
+                cache_dir = self._pdf_cache_dir
+            cache_path = os.path.join(cache_dir, f"{file_id}.pdf")
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            shutil.copyfile(output_path, tmp_path)
+            # Reemplazo atómico: otro caso puede estar leyendo la versión anterior
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar {file_id} en el caché local de PDFs: {e}")
+            return
+        with self._pdf_cache_lock:
+            self._pdf_cache[file_id] = (cache_path, modified_time)
+
+    def clear_pdf_cache(self):
+        """Borra las copias locales de la corrida (se llama al terminar GradingProcess.run)."""
+        with self._pdf_cache_lock:
+            cache_dir, self._pdf_cache_dir = self._pdf_cache_dir, None
+            self._pdf_cache.clear()
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def _download_media(self, file_id, size, output_path):
+        """Descarga binaria: por rangos en paralelo si el archivo es grande, si no en una sola petición."""
+        size = int(size or 0)
+        if size > Config.DRIVE_RANGE_CHUNK_BYTES:
+            self._download_in_ranges(file_id, size, output_path)
+        else:
+            self._execute_download(self.service.files().get_media(fileId=file_id), output_path)
+
+    def _download_in_ranges(self, file_id, size, output_path):
+        """
+        Descarga un archivo grande con varias peticiones Range en paralelo (una conexión cada una),
+        escribiendo cada bloque en su offset del archivo de salida.
+        """
+        url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+        chunk = Config.DRIVE_RANGE_CHUNK_BYTES
+        ranges = [(start, min(start + chunk, size) - 1) for start in range(0, size, chunk)]
+        logger.info(f"Descargando {file_id} ({size} bytes) en {len(ranges)} bloques paralelos...")
+
+        # Se reserva el tamaño final para que cada bloque escriba directo en su posición
+        with open(output_path, 'wb') as f:
+            f.truncate(size)
+
+        def fetch(byte_range):
+            start, end = byte_range
+            try:
+                response = google_manager.get_authorized_session().get(
+                    url,
+                    headers={"Range": f"bytes={start}-{end}"},
+                    timeout=Config.DRIVE_TIMEOUT_SECONDS
+                )
+            except requests.RequestException as e:
+                # Se expone como ConnectionError para que el reintento de download_as_pdf lo cubra
+                raise ConnectionError(f"Fallo descargando bytes {start}-{end} de {file_id}: {e}") from e
+            if response.status_code == 429 or response.status_code >= 500:
+                raise ConnectionError(
+                    f"Drive respondió {response.status_code} en bytes {start}-{end} de {file_id}"
+                )
+            # Otros 4xx (401/403/404...) no se arreglan reintentando: HTTPError falla de inmediato
+            response.raise_for_status()
+            if len(response.content) != end - start + 1:
+                raise ConnectionError(f"Bloque incompleto {start}-{end} de {file_id}")
+            with open(output_path, 'r+b') as f:
+                f.seek(start)
+                f.write(response.content)
+
+        # list() propaga el primer error de cualquier bloque
+        list(self._range_executor.map(fetch, ranges))
+
     def _execute_download(self, request, output_path):
         """Ejecuta la descarga estándar de Drive API."""
         with open(output_path, 'wb') as f:
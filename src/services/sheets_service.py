@@ -1,12 +1,16 @@
 import logging
 import datetime
+import threading
+import requests
+from gspread.exceptions import APIError
 from src.core.google_client import google_manager
 from src.config import Config
 from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
-    retry_if_exception_type,
+    wait_random,
+    retry_if_exception,
     before_sleep_log
 )
 from google.api_core.exceptions import (
@@ -17,6 +21,22 @@ from google.api_core.exceptions import (
 
 logger = logging.getLogger(__name__)
 
+# Fallos de red/tiempo de la API de Sheets que vale la pena reintentar
+_TRANSIENT_SHEETS_ERRORS = (
+    GoogleAPIError,
+    TimeoutError,
+    ConnectionError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout
+)
+
+def _is_transient_sheets_error(exc):
+    """Predicado para tenacity: red, timeouts y APIError de gspread con 429/5xx; otros 4xx fallan de inmediato."""
+    if isinstance(exc, APIError):
+        status_code = getattr(exc.response, "status_code", None) or 0
+        return status_code == 429 or status_code >= 500
+    return isinstance(exc, _TRANSIENT_SHEETS_ERRORS)
+
 class SheetsService:
     """
     Servicio para interactuar con la Google Sheet 'VAWA NEW GRADING'.
@@ -48,10 +68,24 @@ class SheetsService:
         self.spreadsheet_id = Config.SPREADSHEET_ID
         self.sheet_name = Config.SHEET_NAME
         self._sheet = None
+        # Los casos en paralelo comparten el cliente de gspread: las escrituras se serializan
+        self._lock = threading.RLock()
+        # Escrituras pendientes de enviar en lote: rango A1 -> valores
+        self._pending_writes = {}
+        self._pending_lock = threading.Lock()
+        # Serializa los envíos de lotes (un lote viejo no debe llegar después de uno nuevo).
+        # No es self._lock: mientras un lote espera sus reintentos, la hoja sigue disponible.
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flusher = None
 
     @property
     def sheet(self):
         """Lazy load de la hoja para no conectar hasta que sea necesario."""
+        with self._lock:
+            return self._open_sheet()
+
+    def _open_sheet(self):
         if not self._sheet:
             try:
                 # Abrir spreadsheet por ID y seleccionar la hoja por nombre
@@ -69,93 +103,125 @@ class SheetsService:
         """
         rows_data = []
         try:
-            # Obtener todos los valores (es más eficiente que iterar celdas)
-            all_values = self.sheet.get_all_values()
-            
-            # Iterar saltando encabezados (asumimos fila 1 headers)
-            for i, row in enumerate(all_values):
-                row_idx = i + 1  # 1-based index
-                if row_idx == 1: continue 
-
-                # Asegurar que la fila tenga suficientes columnas para leer el status
-                if len(row) >= self.COL_STATUS:
-                    status = row[self.COL_STATUS - 1].strip() # -1 porque lista es 0-based
-                    
-                    if status == 'PENDING PROCESSING':
-                        
-                        # Validar si hay enlaces presentes. Nos aseguraremos de pasar los que existan.
-                        row_data = {
-                            'row_idx': row_idx,
-                            'client_id': row[0],
-                            'client_name': row[1],
-                            'visa_type': row[self.COL_VISA_TYPE - 1] if len(row) >= self.COL_VISA_TYPE else "",
-                            'links': {
-                                'transcript': row[self.COL_TRANSCRIPT - 1] if len(row) >= self.COL_TRANSCRIPT else "",
-                                'doe_abuse': row[self.COL_DOE_ABUSE - 1] if len(row) >= self.COL_DOE_ABUSE else "",
-                                'doe_gmc': row[self.COL_DOE_GMC - 1] if len(row) >= self.COL_DOE_GMC else "",
-                                'dair': row[self.COL_DAIR - 1] if len(row) >= self.COL_DAIR else "",
-                                'fair': row[self.COL_FAIR - 1] if len(row) >= self.COL_FAIR else "",
-                                'rapsheet': row[self.COL_RAPSHEET - 1] if len(row) >= self.COL_RAPSHEET else "",
-                                'summary': row[self.COL_SUMMARY - 1] if len(row) >= self.COL_SUMMARY else ""
-                            }
-                        }
-                        rows_data.append(row_data)
-            
+            # Solo la columna de status (no toda la hoja); luego se piden únicamente las filas pendientes
+            statuses = self.sheet.col_values(self.COL_STATUS)
+
+            # Saltando encabezados (asumimos fila 1 headers); 1-based index
+            pending_idx = [
+                row_idx for row_idx, status in enumerate(statuses, start=1)
+                if row_idx > 1 and status.strip() == 'PENDING PROCESSING'
+            ]
+            if not pending_idx:
+                return rows_data
+
+            # Columnas A..K de las filas pendientes en una sola petición
+            last_col = chr(ord('A') + self.COL_SUMMARY - 1)
+            value_ranges = self.sheet.batch_get([f"A{row_idx}:{last_col}{row_idx}" for row_idx in pending_idx])
+
+            for row_idx, value_range in zip(pending_idx, value_ranges):
+                row = value_range[0] if value_range else []
+                rows_data.append(self._row_to_data(row_idx, row))
+
             return rows_data
 
         except Exception as e:
             logger.error(f"Error leyendo filas pendientes: {e}")
             raise
 
-    @retry(
-        stop=stop_after_attempt(Config.MAX_RETRIES),
-        wait=wait_exponential(
-            multiplier=1,
-            min=Config.RETRY_MIN_WAIT,
-            max=Config.RETRY_MAX_WAIT
-        ),
-        retry=retry_if_exception_type((
-            GoogleAPIError,
-            TimeoutError,
-            ConnectionError
-        )),
-        before_sleep=before_sleep_log(logger, logging.WARNING)
-    )
+    def _row_to_data(self, row_idx, row):
+        """Arma el diccionario de un caso a partir de los valores de su fila (A..K)."""
+        def cell(col):
+            return row[col - 1] if len(row) >= col else ""  # -1 porque lista es 0-based
+
+        # Validar si hay enlaces presentes. Nos aseguraremos de pasar los que existan.
+        return {
+            'row_idx': row_idx,
+            'client_id': cell(1),
+            'client_name': cell(2),
+            'visa_type': cell(self.COL_VISA_TYPE),
+            'links': {
+                'transcript': cell(self.COL_TRANSCRIPT),
+                'doe_abuse': cell(self.COL_DOE_ABUSE),
+                'doe_gmc': cell(self.COL_DOE_GMC),
+                'dair': cell(self.COL_DAIR),
+                'fair': cell(self.COL_FAIR),
+                'rapsheet': cell(self.COL_RAPSHEET),
+                'summary': cell(self.COL_SUMMARY)
+            }
+        }
+
     def update_status(self, row_idx, status):
-        """Actualiza la columna C (Status)."""
-        try:
-            self.sheet.update_cell(row_idx, self.COL_STATUS, status)
-            logger.info(f"Fila {row_idx} status actualizado a: {status}")
-        except Exception as e:
-            logger.error(f"Error actualizando status fila {row_idx}: {e}")
-            raise
+        """Actualiza la columna C (Status). La escritura se encola y se envía en el siguiente lote."""
+        self._enqueue([{'range': f'C{row_idx}', 'values': [[status]]}])
+        logger.info(f"Fila {row_idx} status actualizado a: {status}")
 
-    @retry(
-        stop=stop_after_attempt(Config.MAX_RETRIES),
-        wait=wait_exponential(
-            multiplier=1,
-            min=Config.RETRY_MIN_WAIT,
-            max=Config.RETRY_MAX_WAIT
-        ),
-        retry=retry_if_exception_type((
-            GoogleAPIError,
-            TimeoutError,
-            ConnectionError
-        )),
-        before_sleep=before_sleep_log(logger, logging.WARNING)
-    )
     def mark_processing_start(self, row_idx):
         """Marca inicio: Status PROCESSING y Fecha de Inicio (Columna S)."""
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        updates = [
+        self._enqueue([
             {'range': f'C{row_idx}', 'values': [['PROCESSING']]},
             {'range': f'S{row_idx}', 'values': [[now]]} # Columna S - Start Time
-        ]
-        try:
-            self.sheet.batch_update(updates)
-        except Exception as e:
-            logger.error(f"Error marcando inicio fila {row_idx}: {e}")
-            raise
+        ])
+
+    def _enqueue(self, updates):
+        """
+        Agrega escrituras al lote pendiente (la última por rango gana) y arranca el hilo que
+        las envía cada Config.SHEETS_FLUSH_INTERVAL_SECONDS o al juntar SHEETS_FLUSH_MAX_PENDING.
+        """
+        with self._pending_lock:
+            for update in updates:
+                self._pending_writes.pop(update['range'], None)
+                self._pending_writes[update['range']] = update['values']
+            pending = len(self._pending_writes)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="sheets-flush", daemon=True)
+                self._flusher.start()
+        if pending >= Config.SHEETS_FLUSH_MAX_PENDING:
+            self._flush_event.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(Config.SHEETS_FLUSH_INTERVAL_SECONDS)
+            self._flush_event.clear()
+            self.flush()
+
+    def flush(self, raise_on_error=False):
+        """
+        Envía en un solo batch_update todas las escrituras encoladas.
+        Si falla, las escrituras vuelven a la cola; con raise_on_error (vaciado final) además se
+        propaga el error para que no se pierdan en silencio.
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                if not self._pending_writes:
+                    return
+                updates = [{'range': rng, 'values': values} for rng, values in self._pending_writes.items()]
+                self._pending_writes.clear()
+            try:
+                self._batch_update(updates)
+            except Exception as e:
+                logger.error(f"Error enviando {len(updates)} escrituras a Sheets; se reintentará en el siguiente lote: {e}")
+                with self._pending_lock:
+                    # Sin pisar lo que se haya encolado mientras tanto para esos rangos
+                    for update in updates:
+                        self._pending_writes.setdefault(update['range'], update['values'])
+                if raise_on_error:
+                    raise RuntimeError(
+                        f"Quedaron {len(updates)} escrituras sin enviar a Sheets: "
+                        f"{', '.join(u['range'] for u in updates)}"
+                    ) from e
+
+    def write_status_now(self, row_idx, status):
+        """
+        Escribe el status de inmediato (con reintentos), sin pasar por el lote.
+        Para estados de error: si la escritura falla, el llamador se entera.
+        """
+        # Lo encolado antes para la fila (p. ej. PROCESSING) no debe llegar después del error
+        self.flush()
+        with self._pending_lock:
+            self._pending_writes.pop(f'C{row_idx}', None)
+        self._batch_update([{'range': f'C{row_idx}', 'values': [[status]]}])
+        logger.info(f"Fila {row_idx} status actualizado a: {status}")
 
     @retry(
         stop=stop_after_attempt(Config.MAX_RETRIES),
@@ -163,14 +229,14 @@ class SheetsService:
             multiplier=1,
             min=Config.RETRY_MIN_WAIT,
             max=Config.RETRY_MAX_WAIT
-        ),
-        retry=retry_if_exception_type((
-            GoogleAPIError,
-            TimeoutError,
-            ConnectionError
-        )),
+        ) + wait_random(0, 2),
+        retry=retry_if_exception(_is_transient_sheets_error),
         before_sleep=before_sleep_log(logger, logging.WARNING)
     )
+    def _batch_update(self, updates):
+        with self._lock:
+            self.sheet.batch_update(updates)
+
     def write_grading_results(self, row_idx, result_data):
         """
         Escribe los resultados finales en las columnas M (link), O, P, Q, R, S, T.
@@ -195,22 +261,25 @@ class SheetsService:
                 ]
             ]
             
-            # Rango de actualización
-            range_name = f'M{row_idx}:T{row_idx}'
-            self.sheet.update(range_name=range_name, values=values)
-            
-            # Actualizar status a COMPLETED
-            self.update_status(row_idx, 'COMPLETED')
+            # Lo encolado antes (p. ej. PROCESSING) se envía primero para que no pise el COMPLETED
+            self.flush()
+
+            # Resultados (M:T) y status COMPLETED en una sola petición. _batch_update reintenta;
+            # el error solo se marca aquí, cuando ya no quedan reintentos.
+            self._batch_update([
+                {'range': f'M{row_idx}:T{row_idx}', 'values': values},
+                {'range': f'C{row_idx}', 'values': [['COMPLETED']]}
+            ])
+            with self._pending_lock:
+                # Un status viejo re-encolado tras un lote fallido no debe pisar el COMPLETED
+                self._pending_writes.pop(f'C{row_idx}', None)
             logger.info(f"Fila {row_idx} completada exitosamente.")
 
         except Exception as e:
             logger.error(f"Error escribiendo resultados fila {row_idx}: {e}")
-            # Intentar marcar error en status (esto también tiene retry)
-            try:
-                self.update_status(row_idx, "ERROR SAVING RESULTS")
-            except:
-                pass  # Si ni siquiera podemos marcar el error, al menos loggeamos
+            # Marcar error en status (se encola; el envío del lote tiene retry)
+            self.update_status(row_idx, "ERROR SAVING RESULTS")
             raise
 
 # Instancia global
-sheets_service = SheetsService()
\ No newline at end of file
+sheets_service = SheetsService()
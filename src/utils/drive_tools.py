@@ -5,7 +5,7 @@ import unicodedata
 from pathlib import Path
 from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
 from googleapiclient.errors import HttpError
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
+from tenacity import retry, wait_exponential, wait_random, stop_after_attempt, retry_if_exception_type
 from src.core.google_client import google_manager
 
 logger = logging.getLogger(__name__)
@@ -44,7 +44,7 @@ def normalize_name(name):
     
 @retry(
     retry=retry_if_exception_type(HttpError),
-    wait=wait_exponential(multiplier=1, min=2, max=30),
+    wait=wait_exponential(multiplier=1, min=2, max=30) + wait_random(0, 2),
     stop=stop_after_attempt(5)
 )
 def find_subfolder(parent_id: str, target_names: list) -> tuple[str, str]:
@@ -87,7 +87,7 @@ def find_subfolder(parent_id: str, target_names: list) -> tuple[str, str]:
 
 @retry(
     retry=retry_if_exception_type(HttpError),
-    wait=wait_exponential(multiplier=1, min=4, max=60),
+    wait=wait_exponential(multiplier=1, min=4, max=60) + wait_random(0, 2),
     stop=stop_after_attempt(5)
 )
 def get_google_doc_content(doc_url: str) -> str:
@@ -114,7 +114,7 @@ def get_google_doc_content(doc_url: str) -> str:
 
 @retry(
     retry=retry_if_exception_type(HttpError),
-    wait=wait_exponential(multiplier=1, min=2, max=30),
+    wait=wait_exponential(multiplier=1, min=2, max=30) + wait_random(0, 2),
     stop=stop_after_attempt(3)
 )
 def list_files_in_folder(folder_id: str) -> list:
@@ -138,7 +138,7 @@ def list_files_in_folder(folder_id: str) -> list:
 
 @retry(
     retry=retry_if_exception_type(HttpError),
-    wait=wait_exponential(multiplier=1, min=4, max=60),
+    wait=wait_exponential(multiplier=1, min=4, max=60) + wait_random(0, 2),
     stop=stop_after_attempt(3)
 )
 def upload_file_to_drive(local_path: str, parent_folder_id: str) -> str:
@@ -173,7 +173,7 @@ def upload_file_to_drive(local_path: str, parent_folder_id: str) -> str:
 
 @retry(
     retry=retry_if_exception_type(HttpError),
-    wait=wait_exponential(multiplier=1, min=4, max=60),
+    wait=wait_exponential(multiplier=1, min=4, max=60) + wait_random(0, 2),
     stop=stop_after_attempt(3)
 )
 def create_folder_in_drive(folder_name: str, parent_folder_id: str) -> tuple[str, str]:
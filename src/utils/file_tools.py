@@ -0,0 +1,19 @@
+import os
+import functools
+from pathlib import Path
+
+def read_pdf_bytes(path) -> bytes:
+    """Lee un PDF completo en una sola lectura (sin buffers intermedios)."""
+    return Path(path).read_bytes()
+
+@functools.lru_cache(maxsize=8)
+def _read_pdf_bytes_versioned(path: str, mtime_ns: int, size: int) -> bytes:
+    return read_pdf_bytes(path)
+
+def read_pdf_bytes_cached(path) -> bytes:
+    """
+    Igual que read_pdf_bytes, pero memoiza por (ruta, mtime, tamaño).
+    Pensado para PDFs que se reutilizan (fundamentos); si el archivo cambia se vuelve a leer.
+    """
+    stat = os.stat(path)
+    return _read_pdf_bytes_versioned(str(path), stat.st_mtime_ns, stat.st_size)
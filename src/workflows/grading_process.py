@@ -3,39 +3,102 @@ import os
 import datetime
 import tempfile
 import shutil
+import threading
+import concurrent.futures
 from src.services.sheets_service import sheets_service
 from src.services.drive_service import drive_service
-from src.services.chat_service import chat_service
+from src.services.chat_service import ChatService
 from src.services.cache_service import cache_service
 from src.core.google_client import google_manager
+from src.core.vertex_wrapper import vertex_client
 from src.utils.drive_tools import get_id_from_url
 from src.config import Config
 
 logger = logging.getLogger(__name__)
 
+# Documentos del paciente: nombre legible (también nombre del PDF) -> clave en row_data['links'].
+# El orden es el mismo en que se listan en el prompt.
+PATIENT_DOCUMENTS = (
+    ('TRANSCRIPT_INTERVIEW', 'transcript'),  # MAIN
+    ('DOE_ABUSE', 'doe_abuse'),
+    ('DOE_GMC', 'doe_gmc'),
+    ('DAIR', 'dair'),
+    ('FAIR', 'fair'),
+    ('RAPSHEET', 'rapsheet'),
+    ('AI_SUMMARY', 'summary'),               # MAIN
+)
+
+def _is_valid_link(url):
+    """Validación simple de URL (celdas vacías o con basura corta no cuentan)."""
+    return bool(url) and len(url) > 5
+
+def _has_any_link(row_data):
+    return any(_is_valid_link(row_data['links'][key]) for _, key in PATIENT_DOCUMENTS)
+
 class GradingProcess:
     def __init__(self):
         """Inicializar el caché compartido una sola vez."""
         self.cache_obj = None
+        self.fundamentos_files = []
+        self.prompt_in_cache = False
     
     def run(self):
         logger.info(">>> INICIANDO PROCESO DE GRADING VAWA <<<")
         
-        # 1. Preparar Caché (Fundamentos) - UNA SOLA VEZ para todas las filas
+        # 1. Obtener trabajo pendiente
+        pending_rows = sheets_service.get_pending_rows()
+        logger.info(f"Se encontraron {len(pending_rows)} casos pendientes de procesar.")
+
+        # Filas sin ningún enlace: se marcan de inmediato, sin abrir sesión de IA ni ocupar un hilo
+        without_links = [row for row in pending_rows if not _has_any_link(row)]
+        for row_data in without_links:
+            logger.warning(f"Fila {row_data['row_idx']} ({row_data['client_name']}) no tiene enlaces a documentos.")
+            sheets_service.update_status(row_data['row_idx'], "ERROR: NO LINKS")
+        if without_links:
+            pending_rows = [row for row in pending_rows if _has_any_link(row)]
+
+        if not pending_rows:
+            sheets_service.flush(raise_on_error=True)
+            logger.info(">>> PROCESO FINALIZADO <<<")
+            return
+
+        # Precalentar el cliente de IA en segundo plano mientras se prepara el resto
+        threading.Thread(target=ChatService.warm_up, name="ai-warm-up", daemon=True).start()
+
+        # 2. Preparar Caché (Fundamentos) - UNA SOLA VEZ para todas las filas,
+        # solo si hay suficientes casos para amortizarlo
         try:
             logger.info("Cargando Cache de Fundamentos...")
-            self.cache_obj = cache_service.ensure_fundamentos_cache()
-            logger.info("Cache de fundamentos cargado exitosamente.")
+            self.fundamentos_files = cache_service.list_fundamentos_files()
+            # Instrucciones + prompt WAES: idénticos en todos los casos, se cachean con los fundamentos
+            # (y de paso quedan precargados para las sesiones si no se crea el caché)
+            static_texts = ChatService.load_static_prompt_texts()
+            self.cache_obj = cache_service.ensure_fundamentos_cache(
+                expected_reuses=len(pending_rows),
+                file_paths=self.fundamentos_files,
+                texts=static_texts
+            )
+            self.prompt_in_cache = self.cache_obj is not None
+            if self.cache_obj:
+                logger.info("Cache de fundamentos cargado exitosamente.")
         except Exception as e:
             logger.critical(f"Fallo crítico inicializando caché: {e}")
             return # Detener todo si no hay conocimiento base
 
-        # 2. Obtener trabajo pendiente
-        pending_rows = sheets_service.get_pending_rows()
-        logger.info(f"Se encontraron {len(pending_rows)} casos pendientes de procesar.")
-
-        for row in pending_rows:
-            self.process_single_case(row)
+        try:
+            # Casos en paralelo: el trabajo es casi todo espera de red (Drive, Sheets, Gemini).
+            # process_single_case captura sus propios errores, así que un caso no detiene a los demás.
+            max_workers = max(1, min(Config.PARALLEL_CASES, len(pending_rows)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="caso") as executor:
+                list(executor.map(self.process_single_case, pending_rows))
+        finally:
+            # Fundamentos subidos en línea (modo sin caché) compartidos entre casos
+            vertex_client.release_shared_parts()
+            # Copias de PDFs de pacientes reutilizables durante la corrida: no quedan en disco
+            drive_service.clear_pdf_cache()
+            # Status encolados que aún no se enviaron a Sheets; si no se pueden enviar, el error
+            # se propaga (las filas quedarían en PROCESSING sin que nadie se entere)
+            sheets_service.flush(raise_on_error=True)
 
         logger.info(">>> PROCESO FINALIZADO <<<")
 
@@ -45,13 +108,18 @@ class GradingProcess:
         logger.info(f"--- Procesando Fila {row_idx}: {client_name} ---")
         
         # ✅ IMPORTANTE: Inicializar NUEVA sesión de chat para ESTE caso específico
-        # Esto garantiza que NO hay contaminación cruzada entre casos
+        # Esto garantiza que NO hay contaminación cruzada entre casos (ni entre hilos)
+        chat_service = ChatService()
         try:
             logger.info(f"Inicializando sesión de chat independiente para {client_name}...")
-            chat_service.initialize_session(cache_obj=self.cache_obj)
+            chat_service.initialize_session(
+                cache_obj=self.cache_obj,
+                fundamentos_files=self.fundamentos_files,
+                prompt_in_cache=self.prompt_in_cache
+            )
         except Exception as e:
             logger.error(f"Error inicializando sesión de chat para {client_name}: {e}")
-            sheets_service.update_status(row_idx, f"ERROR: No se pudo iniciar chat - {str(e)[:40]}")
+            self._mark_error(row_idx, f"ERROR: No se pudo iniciar chat - {str(e)[:40]}")
             return
 
         # Crear carpeta temporal para este caso
@@ -64,30 +132,28 @@ class GradingProcess:
 
             # B. Descargar y Normalizar Documentos del Paciente
             links = row_data['links']
-            # Mapeo de nombre legible -> URL
-            docs_to_download = [
-                ('TRANSCRIPT_INTERVIEW', links['transcript']), # MAIN
-                ('DOE_ABUSE', links['doe_abuse']),
-                ('DOE_GMC', links['doe_gmc']),
-                ('DAIR', links['dair']),
-                ('FAIR', links['fair']),
-                ('RAPSHEET', links['rapsheet']),
-                ('AI_SUMMARY', links['summary'])        # MAIN
-            ]
 
             logger.info("Descargando documentos del cliente...")
-            for doc_type, url in docs_to_download:
-                if url and len(url) > 5: # Validación simple de URL
-                    try:
-                        file_id = get_id_from_url(url)
-                        output_path = os.path.join(temp_dir, f"{doc_type}.pdf")
-                        
-                        # DriveService convierte todo a PDF automágicamente
-                        drive_service.download_as_pdf(file_id, output_path)
-                        patient_pdfs.append((doc_type, output_path))
-                    except Exception as e:
-                        logger.warning(f"No se pudo descargar {doc_type} ({url}): {e}")
+            # Solo los documentos con enlace
+            tasks = [(doc_type, links[key]) for doc_type, key in PATIENT_DOCUMENTS if _is_valid_link(links[key])]
+            if tasks:
+                # Descargas independientes en paralelo (pool compartido de Drive):
+                # el caso espera a la más lenta, no a la suma
+                futures = []
+                for doc_type, url in tasks:
+                    output_path = os.path.join(temp_dir, f"{doc_type}.pdf")
+                    # DriveService convierte todo a PDF automágicamente
+                    future = drive_service.submit(drive_service.download_as_pdf, get_id_from_url(url), output_path)
+                    futures.append((doc_type, url, output_path, future))
+
+                # Se recorren en el orden original para que el prompt liste los documentos siempre igual
+                for doc_type, url, output_path, future in futures:
+                    error = future.exception()
+                    if error:
+                        logger.warning(f"No se pudo descargar {doc_type} ({url}): {error}")
                         # No detenemos el proceso, pero el chat tendrá menos contexto
+                        continue
+                    patient_pdfs.append((doc_type, output_path))
 
             if not patient_pdfs:
                 raise ValueError("No se pudieron descargar documentos válidos para el cliente.")
@@ -147,14 +213,18 @@ class GradingProcess:
 
         except Exception as e:
             logger.error(f"Error procesando caso {client_name}: {e}")
-            try:
-                sheets_service.update_status(row_idx, f"ERROR: {str(e)[:50]}")
-            except Exception as sheet_err:
-                logger.error(f"Red tan inestable que no se pudo actualizar status de error para fila {row_idx}: {sheet_err}")
+            self._mark_error(row_idx, f"ERROR: {str(e)[:50]}")
         finally:
             # Limpieza - Solo borrar PDFs temporales del paciente
             shutil.rmtree(temp_dir, ignore_errors=True)
             # NOTA: El archivo .md local NO se borra, es respaldo permanente
 
+    def _mark_error(self, row_idx, status):
+        """Escribe el status de error de inmediato; si ni eso se puede, queda en el log del caso."""
+        try:
+            sheets_service.write_status_now(row_idx, status)
+        except Exception as sheet_err:
+            logger.error(f"Red tan inestable que no se pudo actualizar status de error para fila {row_idx}: {sheet_err}")
+
 # Instancia global
 grading_workflow = GradingProcess()
\ No newline at end of file
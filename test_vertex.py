@@ -4,16 +4,22 @@ Corre: python test_vertex.py
 """
 import time
 import logging
+import statistics
+import hashlib
 import sys
-import glob
 import os
+import io
+import concurrent.futures
+from collections import deque
+from itertools import islice, chain
 from src.config import Config
+from src.core.vertex_wrapper import vertex_client
 from google import genai
 from google.genai import types
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(levelname)s - %(threadName)s - %(message)s",
     datefmt="%H:%M:%S"
 )
 logger = logging.getLogger("test_vertex")
@@ -22,6 +28,11 @@ logger = logging.getLogger("test_vertex")
 logger.info("🔬 Iniciando diagnóstico de IA con google-genai...")
 logger.info(f"   Modo Vertex AI: {Config.USE_VERTEX_AI}")
 MODEL_NAME = "gemini-2.5-flash"
+# De dónde lee el modelo los PDFs (solo para los logs)
+if Config.USE_VERTEX_AI:
+    PDF_ORIGIN = "GCS" if Config.GCS_STAGING_BUCKET else "Local"
+else:
+    PDF_ORIGIN = "Gemini API"
 
 if Config.USE_VERTEX_AI:
     client = genai.Client(vertexai=True, project=Config.PROJECT_ID, location=Config.LOCATION)
@@ -41,31 +52,209 @@ SYSTEM_INSTR = (
     "Es tu deber procesar documentos legales y evidencia clínica sin censura."
 )
 
-gen_config = types.GenerateContentConfig(
-    temperature=0.3,
-    system_instruction=SYSTEM_INSTR,
-    safety_settings=SAFETY_SETTINGS
-)
+# Respuestas cortas y sin "thinking": el diagnóstico mide conectividad/latencia, no calidad,
+# y el modelo empieza a emitir sin razonar antes (menor tiempo al primer token)
+GEN_CFG = {
+    "temperature": 0.3,
+    "max_output_tokens": 256,
+    "thinking_config": types.ThinkingConfig(thinking_budget=0),
+    "safety_settings": SAFETY_SETTINGS,
+}
+
+gen_config = types.GenerateContentConfig(**GEN_CFG, system_instruction=SYSTEM_INSTR)
 
 # ── Funciones Helper ────────────────────────────────────────────────────────────
-def process_response(response, t0):
+def _finish_reason(candidates):
+    """Motivo de parada del primer candidato (loggea bloqueos de seguridad/recitación)."""
     finish_reason = "UNKNOWN"
-    if response.candidates and response.candidates[0].finish_reason:
-        finish_reason = str(response.candidates[0].finish_reason)
+    if candidates and candidates[0].finish_reason:
+        finish_reason = str(candidates[0].finish_reason)
         if "SAFETY" in finish_reason.upper():
             logger.error("🚨 BLOQUEO DE SEGURIDAD DETECTADO (SAFETY).")
         elif "RECITATION" in finish_reason.upper():
             logger.error("🚨 BLOQUEO POR RECITACIÓN DETECTADO.")
+    return finish_reason
 
+def _report(text, finish_reason, t0):
+    if not text:
+        logger.error(f"❌ FALLO. No se pudo extraer texto. Motivo: {finish_reason}")
+        return False
+    logger.info(f"✅ ÉXITO. Respuesta en {time.time()-t0:.1f}s (Parada: {finish_reason}):\n{text[:200]}...\n")
+    return True
+
+def process_response(response, t0):
+    finish_reason = _finish_reason(response.candidates)
     try:
         text = response.text
-        if not text:
-            raise ValueError("Texto vacío.")
-        logger.info(f"✅ ÉXITO. Respuesta en {time.time()-t0:.1f}s (Parada: {finish_reason}):\n{text[:200]}...\n")
-        return True
+    except Exception:
+        text = ""
+    return _report(text, finish_reason, t0)
+
+def _log_stream_stats(arrivals, sizes, start):
+    """
+    Reporta el ritmo real del stream: si el backend agrupa la salida en "mega-chunks",
+    el primer chunk no es el primer token y los huecos entre chunks lo delatan.
+    """
+    if len(arrivals) < 2:
+        return
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    # quantiles(n=20): el índice 9 es p50 y el 18 es p95
+    cuts = statistics.quantiles(gaps, n=20, method="inclusive") if len(gaps) >= 2 else gaps * 19
+    logger.info(
+        f"   Stream: {len(sizes)} chunks | caracteres/chunk p50={statistics.median(sizes):.0f} máx={max(sizes)} | "
+        f"hueco entre chunks p50={cuts[9]*1000:.0f}ms p95={cuts[18]*1000:.0f}ms"
+    )
+    # Rastro de progreso de los últimos chunks, en una sola línea al final (no un log por chunk
+    # mientras se consume el stream, que distorsionaría los tiempos medidos)
+    trail = deque(enumerate(arrivals, 1), maxlen=20)
+    logger.info("   Progreso (chunk@s): " + ", ".join(f"{i}@{at - start:.1f}" for i, at in trail))
+
+def process_stream(response_stream, t0):
+    """Como process_response, pero consumiendo un stream; loggea el primer chunk y el ritmo de llegada."""
+    buffer = io.StringIO()
+    finish_reason = "UNKNOWN"
+    arrivals, sizes = [], []
+    now = time.monotonic
+    start = now()
+    # El primer chunk se atiende fuera del bucle: el bucle no evalúa "¿es el primero?" en cada chunk
+    it = iter(response_stream)
+    first = next(it, None)
+    if first is None:
+        return _report("", finish_reason, t0)
+    logger.info(f"   Primer chunk a los {time.time()-t0:.2f}s")
+    for chunk in chain((first,), it):
+        # EAFP: una sola lectura del atributo por chunk
+        try:
+            t = chunk.text or ""
+        except AttributeError:
+            t = ""
+        if t:
+            arrivals.append(now())
+            sizes.append(len(t))
+            buffer.write(t)
+        if chunk.candidates and chunk.candidates[0].finish_reason:
+            finish_reason = _finish_reason(chunk.candidates)
+    _log_stream_stats(arrivals, sizes, start)
+    return _report(buffer.getvalue(), finish_reason, t0)
+
+def _generate(contents, config):
+    """Envía la petición igual que la app: por streaming solo si Config.USE_STREAMING."""
+    t0 = time.time()
+    if Config.USE_STREAMING:
+        stream = client.models.generate_content_stream(model=MODEL_NAME, contents=contents, config=config)
+        return process_stream(stream, t0)
+    response = client.models.generate_content(model=MODEL_NAME, contents=contents, config=config)
+    return process_response(response, t0)
+
+def _load_pdf_part(label_path):
+    """
+    Lee (Vertex), sube a GCS (Vertex con GCS_STAGING_BUCKET) o sube a la Files API (Gemini API) un PDF.
+    Retorna (label, part, archivo/blob subido o None). Los tamaños se reportan aparte con _log_pdf_size.
+    """
+    label, path = label_path
+    if Config.USE_VERTEX_AI and Config.GCS_STAGING_BUCKET:
+        # Mismo camino que la app: el PDF va a GCS y Vertex lo lee por URI (sin base64 en la petición)
+        part, blob = vertex_client.prepare_pdf_part(path, display_name=label)
+        return label, part, blob
+    if Config.USE_VERTEX_AI:
+        # Part.from_bytes exige bytes: una sola lectura, sin copias intermedias
+        with open(path, "rb") as f_in:
+            data = f_in.read()
+        return label, types.Part.from_bytes(data=data, mime_type="application/pdf"), None
+    # La subida lee directo del handle del archivo: el PDF no se carga completo en memoria
+    with open(path, "rb") as f_in:
+        f = client.files.upload(
+            file=f_in,
+            config={'mime_type': 'application/pdf', 'display_name': label}
+        )
+    f = _wait_until_active(f)
+    return label, types.Part.from_uri(file_uri=f.uri, mime_type="application/pdf"), f
+
+def _log_pdf_size(label, path):
+    """Tamaño desde os.stat: reportarlo no requiere leer ni subir el archivo."""
+    logger.info(f"   {label} ({PDF_ORIGIN}): {os.path.getsize(path)/1024:.1f} KB")
+
+def _file_digest(path):
+    """Hash del contenido del PDF (blake2b de 128 bits), leído por bloques."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f_in:
+        for block in iter(lambda: f_in.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _dedupe_pdfs(pdf_paths, seen):
+    """Quita los PDFs con contenido idéntico a uno ya incluido (o a los hashes de seen)."""
+    unique = []
+    for label, path in pdf_paths:
+        digest = _file_digest(path)
+        if digest in seen:
+            logger.info(f"   {label} es idéntico a otro PDF ya incluido: se omite.")
+            continue
+        seen.add(digest)
+        unique.append((label, path))
+    return unique
+
+def _delete_uploaded(f):
+    """Borra lo subido por _load_pdf_part: blob de staging en GCS (Vertex) o archivo de la Files API."""
+    if Config.USE_VERTEX_AI:
+        f.delete()
+    else:
+        client.files.delete(name=f.name)
+
+def _safe_delete(f):
+    try:
+        _delete_uploaded(f)
     except Exception as e:
-        logger.error(f"❌ FALLO. No se pudo extraer texto. Motivo: {finish_reason}")
-        return False
+        logger.warning(f"No se pudo borrar el archivo {f.name}: {e}")
+
+def _delete_all(uploaded_files):
+    """Borra los archivos subidos en paralelo (cada borrado es un round-trip independiente)."""
+    if not uploaded_files:
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(uploaded_files)) as executor:
+        list(executor.map(_safe_delete, uploaded_files))
+
+def _wait_until_active(f, timeout=120, poll_interval=0.2):
+    """Espera a que un archivo subido pase de PROCESSING a ACTIVE (se llama dentro del pool, en paralelo)."""
+    deadline = time.monotonic() + timeout
+    while f.state == types.FileState.PROCESSING:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{f.display_name} sigue en PROCESSING tras {timeout}s.")
+        time.sleep(poll_interval)
+        f = client.files.get(name=f.name)
+    if f.state == types.FileState.FAILED:
+        raise RuntimeError(f"Gemini no pudo procesar {f.display_name}.")
+    return f
+
+def _config_for(cache):
+    """gen_config normal, o uno que apunta al caché (la system_instruction ya va dentro del caché)."""
+    if cache is None:
+        return gen_config
+    return types.GenerateContentConfig(**GEN_CFG, cached_content=cache.name)
+
+def _create_pdf_cache(pdf_path):
+    """
+    Cachea un PDF (compartido por Test 2 y Test 3) para no reenviarlo ni re-tokenizarlo.
+    Retorna (caché o None, archivos subidos a borrar al final).
+    """
+    label, part, f = _load_pdf_part((os.path.basename(pdf_path), pdf_path))
+    uploaded = [f] if f is not None else []
+    try:
+        cache = client.caches.create(
+            model=MODEL_NAME,
+            config=types.CreateCachedContentConfig(
+                display_name="test-vertex-cache",
+                system_instruction=SYSTEM_INSTR,
+                contents=[types.Content(role="user", parts=[part])],
+                ttl="600s"
+            )
+        )
+        logger.info(f"🗄️ Caché creado para {label}: {cache.name}")
+        return cache, uploaded
+    except Exception as e:
+        # P. ej. el PDF no llega al mínimo de tokens cacheables: los tests lo envían normal
+        logger.warning(f"No se pudo crear el caché, se envía el PDF en cada test: {e}")
+        return None, uploaded
 
 # ── TEST 1: Texto puro (sin PDFs) ───────────────────────────────────────────────
 def test_1_texto_puro():
@@ -74,19 +263,15 @@ def test_1_texto_puro():
     logger.info("=" * 60)
     
     prompt = "Responde en una sola oración: ¿Cuál es la capital de México?"
-    t0 = time.time()
     logger.info(f"⏳ Enviando petición a {MODEL_NAME}...")
     try:
-        response = client.models.generate_content(
-            model=MODEL_NAME, contents=prompt, config=gen_config
-        )
-        return process_response(response, t0)
+        return _generate(prompt, gen_config)
     except Exception as e:
         logger.error(f"❌ FALLO: {e}")
         return False
 
 # ── TEST 2: Un PDF pequeño ──────────────────────────────────────────────────────
-def test_2_un_pdf(pdf_path: str):
+def test_2_un_pdf(pdf_path: str, cache=None):
     logger.info("=" * 60)
     logger.info(f"TEST 2: Un PDF - {pdf_path}")
     logger.info("=" * 60)
@@ -97,89 +282,67 @@ def test_2_un_pdf(pdf_path: str):
     uploaded_files = []
     
     try:
-        if Config.USE_VERTEX_AI:
-            with open(pdf_path, "rb") as f:
-                data = f.read()
-            logger.info(f"   PDF cargado (Local): {len(data)/1024:.1f} KB")
-            prompt_parts.append(types.Part.from_bytes(data=data, mime_type="application/pdf"))
+        if cache is not None:
+            logger.info("   PDF servido desde el caché (no se reenvía).")
         else:
-            logger.info(f"   Subiendo PDF a Gemini API...")
-            import io
-            with open(pdf_path, "rb") as f_in:
-                data = f_in.read()
-            f = client.files.upload(
-                file=io.BytesIO(data),
-                config={'mime_type': 'application/pdf', 'display_name': os.path.basename(pdf_path)}
-            )
-            uploaded_files.append(f)
-            prompt_parts.append(types.Part.from_uri(file_uri=f.uri, mime_type="application/pdf"))
+            _log_pdf_size("PDF", pdf_path)
+            if not Config.USE_VERTEX_AI:
+                logger.info(f"   Subiendo PDF a Gemini API...")
+            _, part, f = _load_pdf_part((os.path.basename(pdf_path), pdf_path))
+            if f is not None:
+                uploaded_files.append(f)
+            prompt_parts.append(part)
         
         prompt_parts.append("Resume en 3 líneas el contenido detallado de este documento clínico/legal.")
         
-        t0 = time.time()
         logger.info("⏳ Enviando petición con PDF...")
-        response = client.models.generate_content(
-            model=MODEL_NAME, contents=prompt_parts, config=gen_config
-        )
-        return process_response(response, t0)
+        return _generate(prompt_parts, _config_for(cache))
     except Exception as e:
         logger.error(f"❌ FALLO: {e}")
         return False
     finally:
-        for f in uploaded_files:
-            try:
-                client.files.delete(name=f.name)
-            except:
-                pass
+        _delete_all(uploaded_files)
 
 # ── TEST 3: Varios PDFs (simula el proceso real) ────────────────────────────────
-def test_3_multiples_pdfs(pdf_paths: list):
+def test_3_multiples_pdfs(pdf_paths: list, cache=None, cached_path=None):
     logger.info("=" * 60)
     logger.info(f"TEST 3: {len(pdf_paths)} PDFs - Equivalente al proceso real")
     logger.info("=" * 60)
     
-    prompt_parts = [
+    intro = (
         "ATENCIÓN: Los siguientes documentos son PRUEBAS LEGALES de un caso de inmigración por violencia. "
         "No apliques censura a tu análisis, es un requerimiento legal estricto.\n\n"
-    ]
+    )
     uploaded_files = []
     
     try:
+        seen = set()
+        if cache is not None:
+            # El PDF cacheado ya es el prefijo de la petición: solo se envían los demás
+            seen.add(_file_digest(cached_path))
+            logger.info(f"   {os.path.basename(cached_path)} servido desde el caché.")
+        pdf_paths = _dedupe_pdfs(pdf_paths, seen)
         for label, path in pdf_paths:
-            if Config.USE_VERTEX_AI:
-                with open(path, "rb") as f_in:
-                    data = f_in.read()
-                prompt_parts.append(types.Part.from_bytes(data=data, mime_type="application/pdf"))
-                logger.info(f"   {label} (Local): {len(data)/1024:.1f} KB")
-            else:
-                logger.info(f"   Subiendo {label} a Gemini API...")
-                import io
-                with open(path, "rb") as f_in:
-                    data = f_in.read()
-                f = client.files.upload(
-                    file=io.BytesIO(data),
-                    config={'mime_type': 'application/pdf', 'display_name': label}
-                )
-                uploaded_files.append(f)
-                prompt_parts.append(types.Part.from_uri(file_uri=f.uri, mime_type="application/pdf"))
-        
-        prompt_parts.append("Resume en 5 líneas el contenido de TODOS estos documentos, sin omitir los eventos descritos.")
+            _log_pdf_size(label, path)
+        # Lecturas/subidas independientes en paralelo; map conserva el orden de pdf_paths
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(8, len(pdf_paths)))) as executor:
+            results = list(executor.map(_load_pdf_part, pdf_paths))
+        uploaded_files.extend(f for _, _, f in results if f is not None)
+
+        # La lista del prompt se arma de una vez, con su tamaño final
+        prompt_parts = [
+            intro,
+            *(part for _, part, _ in results),
+            "Resume en 5 líneas el contenido de TODOS estos documentos, sin omitir los eventos descritos."
+        ]
         
-        t0 = time.time()
         logger.info("⏳ Enviando petición con múltiples PDFs...")
-        response = client.models.generate_content(
-            model=MODEL_NAME, contents=prompt_parts, config=gen_config
-        )
-        return process_response(response, t0)
+        return _generate(prompt_parts, _config_for(cache))
     except Exception as e:
         logger.error(f"❌ FALLO: {e}")
         return False
     finally:
-        for f in uploaded_files:
-            try:
-                client.files.delete(name=f.name)
-            except:
-                pass
+        _delete_all(uploaded_files)
 
 # ── MAIN ────────────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
@@ -188,17 +351,36 @@ if __name__ == "__main__":
         logger.error("❌ Fallo en Test 1. Verifica credenciales o conexión.")
         sys.exit(1)
 
-    pdfs = glob.glob(r"fundamentos\*.pdf", recursive=True)
+    # Solo se usan hasta 4 PDFs: la búsqueda se detiene al encontrarlos (sin recorrer todo output/)
+    pdfs = list(islice((str(p) for p in Config.FUNDAMENTOS_DIR.glob("*.pdf")), 4))
     if not pdfs:
-        pdfs = glob.glob(r"output\grading_results\**\*.pdf", recursive=True)
+        pdfs = list(islice((str(p) for p in Config.LOCAL_OUTPUT_DIR.rglob("*.pdf")), 4))
         
     if not pdfs:
         logger.warning("No hay PDFs locales de prueba. Solo se ejecutó Test 1.")
         sys.exit(0)
 
-    test_2_un_pdf(pdfs[0])
+    # Con ENABLE_EXPLICIT_CACHE, el PDF que comparten Test 2 y Test 3 se sube/tokeniza una sola vez
+    cache, cache_files = None, []
+    if Config.ENABLE_EXPLICIT_CACHE:
+        cache, cache_files = _create_pdf_cache(pdfs[0])
+
+    try:
+        # Test 3 solo corre si Test 2 pasó: si falla con un PDF (auth, cuota, bloqueo),
+        # subir varios solo repetiría el mismo error
+        ok2 = test_2_un_pdf(pdfs[0], cache=cache)
+        if not ok2:
+            logger.error("❌ Fallo en Test 2. Se omite Test 3 (el camino con un solo PDF no funciona).")
+            sys.exit(2)
 
-    if len(pdfs) >= 2:
-        test_3_multiples_pdfs([(os.path.basename(p), p) for p in pdfs[:4]])
+        if len(pdfs) >= 2:
+            test_3_multiples_pdfs([(os.path.basename(p), p) for p in pdfs[:4]], cache=cache, cached_path=pdfs[0])
+    finally:
+        if cache is not None:
+            try:
+                client.caches.delete(name=cache.name)
+            except Exception as e:
+                logger.warning(f"No se pudo borrar el caché {cache.name}: {e}")
+        _delete_all(cache_files)
     
     logger.info("✅ Diagnóstico finalizado.")
\ No newline at end of file